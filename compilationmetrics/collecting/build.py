@@ -0,0 +1,149 @@
+# Identify the build that a compilation is part of.
+#
+# If $COMPILATION_METRICS_BUILD_ID is set, it's the build's identifier, e.g.
+# a CI job's ID, and it can be shared by compilations on many machines.
+# Otherwise, the compiler wrapper's ancestor processes are searched for a
+# build tool (make, ninja, etc.), and the topmost one found (the outermost
+# "make" of a recursive make) identifies the build by its process ID and
+# start time, qualified by the boot ID of the machine so that it's unique
+# across machines and reboots.  If there's no such ancestor, the compilation
+# isn't part of a build.
+#
+# The build is described by a dict
+#
+#     {
+#         'identifier': text,
+#         'tool': name of the build tool, or None,
+#         'startDatetime': ISO 8601 UTC time the build tool started, or None,
+#         'cores': number of CPUs available to the compilation
+#     }
+#
+# This must be called in the wrapper process itself, before any deferred
+# work is detached from it (see 'deferred.py'), since a detached process no
+# longer has the build tool among its ancestors.
+
+import os
+
+_buildIdEnvKey = 'COMPILATION_METRICS_BUILD_ID'
+
+_buildTools = frozenset(['make', 'gmake', 'bmake', 'ninja', 'samu'])
+
+_maxDepth = 64
+
+
+def _readStat(pid):
+    # Return (name, ppid, startTicks).  See 'sampler.readStat'.
+    with open('/proc/{}/stat'.format(pid), 'rb') as file:
+        data = file.read()
+    nameEnd = data.rindex(b')')
+    name = data[data.index(b'(') + 1:nameEnd].decode('utf8', 'replace')
+    fields = data[nameEnd + 2:].split()
+    return name, int(fields[1]), int(fields[19])
+
+
+def _bootId():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            return file.read().strip()
+    except OSError:
+        import platform
+        return platform.node()
+
+
+def _startDatetime(startTicks):
+    # /proc/PID/stat has the start time in ticks since boot, and /proc/stat
+    # has the boot time in seconds since the epoch.
+    import datetime
+
+    with open('/proc/stat', 'rb') as file:
+        for line in file:
+            if line.startswith(b'btime '):
+                bootSeconds = int(line.split()[1])
+                break
+        else:
+            return None
+    seconds = bootSeconds + startTicks / os.sysconf('SC_CLK_TCK')
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat()
+
+
+def _cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+# Return the outermost build tool among the ancestors of this process as
+# (name, pid, startTicks), or None if there isn't one.
+#
+def _buildToolAncestor():
+    found = None
+    pid = os.getppid()
+    for _ in range(_maxDepth):
+        if pid <= 1:
+            break
+        try:
+            name, ppid, startTicks = _readStat(pid)
+        except (OSError, ValueError, IndexError):
+            break
+        if name in _buildTools:
+            found = name, pid, startTicks
+        pid = ppid
+    return found
+
+
+# Return the dict described at the top of this file, or None if this process
+# isn't part of a build.
+#
+def currentBuild():
+    identifier = os.environ.get(_buildIdEnvKey)
+    if identifier:
+        return {
+            'identifier': identifier,
+            'tool': None,
+            'startDatetime': None,
+            'cores': _cores()
+        }
+
+    ancestor = _buildToolAncestor()
+    if ancestor is None:
+        return None
+
+    name, pid, startTicks = ancestor
+    try:
+        startDatetime = _startDatetime(startTicks)
+    except (OSError, ValueError):
+        startDatetime = None
+    return {
+        'identifier': '{}-{}-{}'.format(_bootId(), pid, startTicks),
+        'tool': name,
+        'startDatetime': startDatetime,
+        'cores': _cores()
+    }
+
+
+if __name__ == '__main__':
+    import json
+
+    print(json.dumps(currentBuild(), indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
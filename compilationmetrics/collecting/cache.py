@@ -0,0 +1,41 @@
+# Locate the per-user directory where the compiler wrapper keeps files that
+# it would otherwise have to recreate on every compilation.
+#
+# The directory is $COMPILATION_METRICS_CACHE if set, and otherwise
+# "compilation-metrics" under $XDG_CACHE_HOME (by default, ~/.cache).
+
+import os
+
+_cacheEnvKey = 'COMPILATION_METRICS_CACHE'
+
+
+def cacheDirectory(*parts):
+    directory = os.environ.get(_cacheEnvKey)
+    if not directory:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'compilation-metrics')
+    return os.path.join(directory, *parts)
+
+
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
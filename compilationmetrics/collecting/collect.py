@@ -1,19 +1,21 @@
+# Run the compiler, and then collect and record metrics about the compilation.
+#
+# This module is imported by every invocation of the compiler wrapper, so it
+# imports almost nothing at module scope.  Everything else (the measuring
+# helper, the database, git, the spool, etc.) is imported by the functions
+# that use it, so that a failed compilation, or a command with nothing to
+# measure, costs little more than the interpreter's own startup.
+
 from . import command
-from . import git
-from . import measure
-from ..database.open import connect
-from ..database.write import createEntry
 
-import sys
-import platform
-import resource
-import subprocess
 import os
-import getpass
-import traceback
+import sys
 
 
 def _machineInfo():
+    import platform
+    import resource
+
     uname = platform.uname()
     return {
         'system': uname[0],
@@ -26,61 +28,250 @@ def _machineInfo():
     }
 
 
-def _writeToDatabaseImpl(user, startDatetime, durationSeconds, outputSizeBytes,
-                         sourceInfo, machineInfo, resources, compilerPath,
-                         command):
-    db = connect()
-    createEntry(db, user, startDatetime, durationSeconds, outputSizeBytes,
-                sourceInfo, machineInfo, resources, compilerPath, command)
+def _entryImpl(user, startDatetime, durationSeconds, outputSizeBytes,
+               sourceInfo, machineInfo, resources, compilerPath, command,
+               includes=None, timeTrace=None, compilerPasses=None,
+               resourceSeries=None, subprocesses=None, sampleWeight=1,
+               wrapperOverhead=None, build=None, key=None):
+    entry = {
+        'user': user,
+        'startDatetime': startDatetime,
+        'durationSeconds': durationSeconds,
+        'outputObjectSizeBytes': outputSizeBytes,
+        'sourceFileInfo': sourceInfo,
+        'machineInfo': machineInfo,
+        'resourceInfo': resources,
+        'compilerPath': compilerPath,
+        'command': command,
+        'includes': includes,
+        'timeTrace': timeTrace,
+        'compilerPasses': compilerPasses,
+        'resourceSeries': resourceSeries,
+        'subprocesses': subprocesses,
+        'sampleWeight': sampleWeight,
+        'wrapperOverhead': wrapperOverhead,
+        'build': build
+    }
+    if key is not None:
+        entry['compilationKey'] = key
+    return entry
+
+
+# Return the arguments to 'write.addEntry' that describe 'request'.  A
+# request that was spooled (see 'spool.py') also has a key, which becomes the
+# 'compilationKey' used by 'write.addEntries'.
+#
+def toEntry(request):
+    return _entryImpl(**request)
+
+
+# Add the compilation described by 'request' to 'db' without committing.
+# Return the key of the compilation.  The machine's key is looked up in, or
+# added to, the cache of 'machinekey.py'.
+#
+def addToDatabase(db, request):
+    from . import machinekey
+    from ..database.write import addEntry, addMachine
+
+    entry = toEntry(request)
+    entry.pop('compilationKey', None)
+    machineInfo = entry['machineInfo']
+
+    machineKey = machinekey.cachedKey(db, machineInfo)
+    if machineKey is None:
+        machineKey = addMachine(db, machineInfo)
+        machinekey.remember(db, machineInfo, machineKey)
+    return addEntry(db, machineKey=machineKey, **entry)
 
 
+# Add the compilation described by 'request' to the database in its own
+# transaction, retrying if the database is busy (see
+# 'open.writeTransaction'), and then add the time taken to commit it to its
+# wrapper overhead (see 'overhead.py').
+#
 def writeToDatabase(request):
-    return _writeToDatabaseImpl(**request)
+    from . import overhead
+    from ..database.open import connect, writeTransaction
+    from ..database.write import addWrapperOverhead
+    import contextlib
+    import sqlite3
+    import time
 
+    with overhead.timing('connect'):
+        db = connect()
+    request = dict(request)
+    request['wrapperOverhead'] = (request.get('wrapperOverhead') or
+                                  []) + overhead.take()
 
-def _lineCount(path):
+    def add(db):
+        nonlocal workDone
+        with overhead.timing('createEntry'):
+            compilationKey = addToDatabase(db, request)
+        addWrapperOverhead(db, 'insert', compilationKey, overhead.take())
+        workDone = time.monotonic()
+        return compilationKey
+
+    def addCommit(db):
+        addWrapperOverhead(db, 'insert', compilationKey, overhead.take())
+
+    workDone = None
+    try:
+        compilationKey = writeTransaction(db, add)
+        # The commit can't be timed within its own transaction, so store its
+        # time afterward.  The compilation is recorded by then, so failing to
+        # store the time isn't worth the spool.
+        overhead.add('commit', time.monotonic() - workDone)
+        with contextlib.suppress(sqlite3.Error):
+            writeTransaction(db, addCommit)
+    finally:
+        db.close()
+
+
+# Return the path to the file that counts records that could be neither
+# written to the database nor saved in the fallback spool.  It has one line
+# per such record.
+#
+def droppedPath():
+    from .cache import cacheDirectory
+    return cacheDirectory('dropped-records')
+
+
+# Having failed to write 'request' to the database because of the specified
+# 'error', save it in the fallback spool in the cache directory (see
+# 'cache.py'), to be ingested later (see 'spool.py'), and say so on standard
+# error.  If that fails too, count the record as dropped.  Return whether the
+# record was saved.
+#
+def _fallBack(request, error):
+    from .cache import cacheDirectory
+    from . import spool
+    import datetime
+
+    directory = cacheDirectory('fallback-spool')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        spool.append(request, directory)
+        print('compilation-metrics: Unable to write to the database ({}). '
+              'The record was saved in {}; ingest it with "python3 -m '
+              'compilationmetrics.collecting.spool ingest {}".'.format(
+                  error, directory, directory),
+              file=sys.stderr)
+        return True
+    except Exception:
+        pass
+
+    path = droppedPath()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as file:
+        file.write('{} {}\n'.format(datetime.datetime.utcnow().isoformat(),
+                                    error))
     with open(path) as file:
-        return sum(1 for line in file)
-
-
-def _preprocessSource(cmd):
-    # Strip away the "-c" flag (meaning "compile it") and the "-o" flag
-    # (meaning "output file").  Use all of the other command arguments,
-    # together with "-E", to have the compiler print the preprocessed source to
-    # standard output.  Then capture that output and calculate the number of
-    # lines and bytes.
-    cmd = cmd.withoutOutputPath().without('-c').withFlag('-E')
-    sp = subprocess
-    child = sp.Popen(cmd, stdin=sp.DEVNULL, stdout=sp.PIPE, stderr=sp.DEVNULL)
-    sizeBytes = 0
-    lineCount = 0
-    while True:
-        line = child.stdout.readline()
-        if not line:
-            child.wait()
-            return sizeBytes, lineCount
-        sizeBytes += len(line)
-        lineCount += 1
-
-
-def _doMetrics(cmd, start, durationSeconds, resources, callback):
+        count = sum(1 for _ in file)
+    print('compilation-metrics: Unable to write to the database ({}). The '
+          'record was dropped; {} have been dropped in all (see {}).'.format(
+              error, count, path),
+          file=sys.stderr)
+    return False
+
+
+# Append 'request' to the spool if one is configured (see 'spool.py'),
+# otherwise hand it to the collector daemon if one is listening (see
+# 'daemon.py'), and otherwise write it to the database directly, falling back
+# to a spool if that fails.  The spool and the daemon are configured by
+# environment variables, which are checked before importing either module,
+# so that writing directly doesn't pay for their imports (e.g. the daemon's
+# 'socketserver' and 'threading').
+#
+def record(request):
+    if os.environ.get('COMPILATION_METRICS_SPOOL'):
+        from . import spool
+        if spool.append(request):
+            return
+    if os.environ.get('COMPILATION_METRICS_SOCKET'):
+        from . import daemon
+        if daemon.send(request):
+            return
+    try:
+        writeToDatabase(request)
+    except Exception as error:
+        if not _fallBack(request, error):
+            raise
+
+
+def _preprocessCommand(cmd):
+    # Strip away the "-c" flag (meaning "compile it"), the "-o" flag (meaning
+    # "output file"), and any flags that would have the compiler overwrite the
+    # dependency file or the time trace.  Use all of the other command
+    # arguments, together with "-E", to have the compiler print the
+    # preprocessed source to standard output.
+    return cmd.withoutOutputPath().without('-c').withoutDependencyFlags(
+    ).withoutTimeTraceFlags().withFlag('-E')
+
+
+def _preprocessSource(cmd, traceIncludes=False):
+    # Run the preprocessing command 'cmd' (see '_preprocessCommand'), capture
+    # its output and calculate the number of lines and bytes, and, if
+    # 'traceIncludes', how much of it came from each header (see
+    # 'includes.py').
+    from . import count
+    from . import includes
+    import subprocess as sp
+
+    child = sp.Popen(cmd,
+                     stdin=sp.DEVNULL,
+                     stdout=sp.PIPE,
+                     stderr=sp.DEVNULL,
+                     bufsize=0)
+    with child.stdout:
+        if traceIncludes:
+            result = includes.traceStream(child.stdout)
+        else:
+            sizeBytes, lineCount, _ = count.countStream(child.stdout)
+            result = sizeBytes, lineCount, None
+    child.wait()
+    return result
+
+
+def _doMetrics(cmd, start, durationSeconds, resources, stderrCopy,
+               resourceSeries, subprocesses, decision, build, callback):
+    from . import count
+    from . import git
+    from . import includes
+    from . import overhead
+    from . import preprocessed
+    from . import timereport
+    from . import timetrace
+    import getpass
+
     sourcePath, outputPath, compilerPath, error = cmd.getPaths()
     if error:
         return  # TODO: In verbose mode, display why.
 
+    # See 'policy.py'.
+    sampleWeight, detailed = decision
+
     source = os.path.basename(sourcePath)
-    sourceLineCount = _lineCount(sourcePath)
-    sourceSize = os.path.getsize(sourcePath)
+    with overhead.timing('count'):
+        sourceSize, sourceLineCount, _ = count.countFile(sourcePath)
     outputSize = os.path.getsize(outputPath)
-    preprocessedSourceSize, preprocessedSourceLineCount = _preprocessSource(
-        cmd)
-
-    if git.hasGit() and git.inAnyRepo(sourcePath):
-        revision = git.getHeadRevision(sourcePath)
-        diff = git.diffHead(sourcePath)
+    if detailed:
+        with overhead.timing('preprocess'):
+            preprocessedSourceSize, preprocessedSourceLineCount, headers = \
+                preprocessed.metrics(cmd, _preprocessCommand(cmd),
+                                     _preprocessSource, includes.enabled())
+        with overhead.timing('git'):
+            revision, diff = git.headRevisionAndDiff(sourcePath)
     else:
-        revision = ''
-        diff = ''
+        preprocessedSourceSize = preprocessedSourceLineCount = None
+        headers = None
+        revision, diff = '', ''
+
+    timeTrace = timetrace.readTimeTrace(cmd, start)
+
+    compilerPasses = None
+    if stderrCopy is not None:
+        compilerPasses = timereport.parseTimeReport(
+            stderrCopy.getvalue().decode('utf8', 'replace'))
 
     sourceInfo = {
         # TODO: name relative to git repo root
@@ -103,23 +294,99 @@ def _doMetrics(cmd, start, durationSeconds, resources, callback):
         'machineInfo': _machineInfo(),
         'resources': resources,
         'compilerPath': compilerPath,
-        'command': cmd
+        'command': cmd,
+        'includes': headers,
+        'timeTrace': timeTrace,
+        'compilerPasses': compilerPasses,
+        'resourceSeries': resourceSeries or None,
+        'subprocesses': subprocesses,
+        'sampleWeight': sampleWeight,
+        'build': build,
+        'wrapperOverhead': overhead.take()
     }
 
     callback(request)
 
 
-def collect(args, callback=writeToDatabase, debug=False):
+def collect(args, callback=record, debug=False):
+    from . import overhead
+
+    startupSeconds = overhead.secondsSinceProcessStart()
+    if startupSeconds is not None:
+        overhead.add('startup', startupSeconds)
+
     cmd = command.Command(args)
     if len(cmd) == 0:
         return 0  # Nothing to do
 
-    rc, start, durationSeconds, resources = measure.call(cmd)
+    import time
+    from . import measure
+
+    # If the compiler is going to report the time spent in each of its passes
+    # (GCC's "-ftime-report"), keep a copy of the report (see 'timereport.py').
+    stderrCopy = None
+    if any(arg.startswith('-ftime-report') for arg in cmd):
+        import io
+        stderrCopy = io.BytesIO()
+
+    # If asked to, sample the compiler's memory and CPU usage while it runs
+    # (see 'sampler.py'), and tally them for each program that it runs (see
+    # 'subprocesses.py').
+    from . import sampler
+    from . import subprocesses
+    tally = None
+    if subprocesses.enabled():
+        tally = subprocesses.Tally(skipRoot=measure.usesHelper())
+    resourceSampler = None
+    onSpawn = None
+    if sampler.interval() is not None or tally is not None:
+        resourceSampler = sampler.Sampler(
+            sampler.interval() or sampler.defaultInterval, tally)
+        onSpawn = resourceSampler.start
+
+    beforeCall = time.monotonic()
+    rc, start, durationSeconds, resources = measure.call(
+        cmd, stderrCopy, onSpawn)
+    overhead.add('measure', time.monotonic() - beforeCall - durationSeconds)
+    resourceSeries = None
+    subprocessRows = None
+    if resourceSampler is not None:
+        resourceSeries = resourceSampler.stop()
+        if sampler.interval() is None:
+            resourceSeries = None  # only the tally was asked for
+        if tally is not None:
+            subprocessRows = tally.finish(resources['userCpuTime'],
+                                          resources['systemCpuTime'])
     if rc != 0:
         return rc  # Compilation failed, so there's nothing to do.
 
+    if len(cmd) < 2:
+        return rc  # No source file, so there's nothing to record.
+
+    # Decide whether to record this compilation at all (see 'policy.py').
+    from . import policy
+    decision = policy.decide(cmd.sourcePath(), durationSeconds, resources)
+    if decision is None:
+        return rc
+
+    # Find the build before possibly detaching from it (see 'build.py').
+    from . import build
+    currentBuild = build.currentBuild()
+
+    from . import deferred
+    import traceback
+
+    def doMetrics():
+        _doMetrics(cmd, start, durationSeconds, resources, stderrCopy,
+                   resourceSeries, subprocessRows, decision, currentBuild,
+                   callback)
+
     try:
-        _doMetrics(cmd, start, durationSeconds, resources, callback)
+        if deferred.maxWorkers() > 0:
+            # Finish up in the background, and return now (see 'deferred.py').
+            deferred.runDetached(doMetrics, debug)
+        else:
+            doMetrics()
     except Exception:
         if debug:
             traceback.print_exc(file=sys.stderr)
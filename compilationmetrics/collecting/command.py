@@ -1,7 +1,6 @@
 from ..enforce import enforce
 
 import os
-from distutils.spawn import find_executable
 
 
 # Wrapper around a list of command line arguments used to invoke the compiler.
@@ -58,6 +57,79 @@ class Command(list):
             # The object name is combined with the arg.
             return arg[len(flag):]
 
+    # Return the value of the last occurrence of the specified 'flag', which
+    # is either the argument following the flag or the remainder of an
+    # argument that begins with the flag, e.g. "-MF foo.d" or "-MFfoo.d".
+    # Return None if 'flag' does not appear.
+    def _lastFlagValue(self, flag):
+        for i in range(len(self) - 1, -1, -1):
+            arg = self[i]
+            if arg == flag:
+                enforce(i + 1 < len(self),
+                        'The last argument is "{}".'.format(flag))
+                return self[i + 1]
+            elif arg.startswith(flag):
+                return arg[len(flag):]
+        return None
+
+    # Return the path to the dependency file (the make rule listing the
+    # included headers) that the compiler writes, as with "-MD".
+    def dependencyPath(self):
+        path = self._lastFlagValue('-MF')
+        if path is not None:
+            return path
+
+        enforce('-MD' in self or '-MMD' in self,
+                'The command does not write a dependency file.')
+        # By default, the file is named after the output file.
+        return os.path.splitext(self.outputPath())[0] + '.d'
+
+    # Return a copy of this command that doesn't write a dependency file.
+    def withoutDependencyFlags(self):
+        flagsWithValues = ('-MF', '-MT', '-MQ')
+        flagsAlone = ('-M', '-MM', '-MD', '-MMD', '-MP', '-MG')
+        args = []
+        skipNext = False
+        for arg in self:
+            if skipNext:
+                skipNext = False
+            elif arg in flagsWithValues:
+                skipNext = True
+            elif arg in flagsAlone or arg.startswith(flagsWithValues):
+                pass
+            else:
+                args.append(arg)
+        return Command(args)
+
+    # Return the path to the JSON trace that clang writes when given
+    # "-ftime-trace" or "-ftime-trace=PATH", or None if the command doesn't
+    # ask for one.
+    def timeTracePath(self):
+        for arg in reversed(self):
+            if arg == '-ftime-trace':
+                path = None
+                break
+            elif arg.startswith('-ftime-trace='):
+                path = arg[len('-ftime-trace='):]
+                break
+        else:
+            return None
+
+        # By default, and when PATH is a directory, the file is named after
+        # the output file.
+        output = self.outputPath()
+        if path is None:
+            return os.path.splitext(output)[0] + '.json'
+        if path.endswith('/') or os.path.isdir(path):
+            name = os.path.splitext(os.path.basename(output))[0] + '.json'
+            return os.path.join(path, name)
+        return path
+
+    # Return a copy of this command that doesn't write a time trace.
+    def withoutTimeTraceFlags(self):
+        return Command(arg for arg in self
+                       if not arg.startswith('-ftime-trace'))
+
     def sourcePath(self):
         enforce(len(self) > 1, 'Command must have at least two parts.')
         return os.path.abspath(self[-1])
@@ -69,7 +141,8 @@ class Command(list):
 
     def compilerPath(self):
         enforce(len(self) > 0, 'Command is empty.')
-        return find_executable(self[0])
+        from shutil import which  # only when needed; it's slow to import
+        return which(self[0])
 
     def info(self):
         return {
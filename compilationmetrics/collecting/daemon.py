@@ -0,0 +1,307 @@
+# Collect compilation records from many compiler wrappers over a Unix domain
+# socket, and write them to the database in batches.
+#
+# Under a parallel build, every wrapper writing to the database itself means
+# that each one connects, creates tables, and commits on its own, all of them
+# contending for the same write lock.  Instead, a wrapper can hand its record
+# to this daemon (see 'send'), which commits many records per transaction.
+#
+# The protocol is one JSON object per connection.  The client writes the
+# object and shuts down its end of the connection.  The object is either
+#
+#     {"record": <request>}
+#
+# where <request> is the dict built by 'collect._doMetrics', or
+#
+#     {"stats": null}
+#
+# to which the daemon replies with a JSON object of counters (see 'Counters').
+
+from ..database.open import connect, isBusy, writeTransaction
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+_socketEnvKey = 'COMPILATION_METRICS_SOCKET'
+
+
+def socketPath():
+    return os.environ.get(_socketEnvKey)
+
+
+def _request(path, message, timeoutSeconds):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeoutSeconds)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode('utf8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+
+# Hand the specified compilation 'request' to the daemon listening at the
+# specified 'path' (by default, the value of $COMPILATION_METRICS_SOCKET).
+# Return whether the daemon accepted the record.  This does not wait for the
+# record to be written to the database.
+#
+def send(request, path=None, timeoutSeconds=1):
+    path = path or socketPath()
+    if not path:
+        return False
+
+    try:
+        _request(path, {'record': request}, timeoutSeconds)
+        return True
+    except OSError:
+        return False  # Nobody is listening, so the caller can fall back.
+
+
+# Return the counters of the daemon listening at the specified 'path'.
+#
+def stats(path=None, timeoutSeconds=5):
+    path = path or socketPath()
+    return json.loads(_request(path, {'stats': None}, timeoutSeconds))
+
+
+class Counters(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.startTime = time.time()
+        self.received = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.maxBatchSize = 0
+        self.maxQueueDepth = 0
+
+    def onReceived(self, queueDepth):
+        with self._lock:
+            self.received += 1
+            self.maxQueueDepth = max(self.maxQueueDepth, queueDepth)
+
+    def onBatch(self, written, failed):
+        with self._lock:
+            self.written += written
+            self.failed += failed
+            self.batches += 1
+            self.maxBatchSize = max(self.maxBatchSize, written + failed)
+
+    def snapshot(self, queueDepth):
+        with self._lock:
+            uptime = time.time() - self.startTime
+            return {
+                'uptimeSeconds': uptime,
+                'received': self.received,
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches,
+                'maxBatchSize': self.maxBatchSize,
+                'queueDepth': queueDepth,
+                'maxQueueDepth': self.maxQueueDepth,
+                'writtenPerSecond': self.written / uptime if uptime else 0
+            }
+
+
+# Take records off of the specified 'records' queue and write them to the
+# database at 'dbPath', one transaction per batch.  A batch is whatever is in
+# the queue when the writer gets to it, up to 'maxBatchSize' records, so that
+# the busier the build, the more records each commit covers.  A busy database
+# is retried (see 'open.writeTransaction').  Each record that can't be
+# written anyway is handed to 'fallBack(request, error)'.  Return once
+# '_stop' is taken off of the queue, having written the records before it.
+#
+def _writeBatches(records, counters, dbPath, addToDatabase, fallBack,
+                  maxBatchSize, debug):
+    db = connect(dbPath)
+    stopping = False
+    while not stopping:
+        batch = []
+        request = records.get()
+        while True:
+            if request is _stop:
+                stopping = True
+                break
+            batch.append(request)
+            if len(batch) == maxBatchSize:
+                break
+            try:
+                request = records.get_nowait()
+            except queue.Empty:
+                break
+        if not batch:
+            continue
+
+        def addBatch(db):
+            failures = []  # [(request, error)]
+            for request in batch:
+                # Use a savepoint, nested in the batch's transaction, so that
+                # a record that fails halfway through doesn't leave part of
+                # itself behind in the batch.
+                db.execute('savepoint record;')
+                try:
+                    addToDatabase(db, request)
+                    db.execute('release record;')
+                except Exception as error:
+                    if isBusy(error):
+                        raise  # Retry the whole batch.
+                    db.execute('rollback to record;')
+                    db.execute('release record;')
+                    failures.append((request, error))
+                    if debug:
+                        traceback.print_exc(file=sys.stderr)
+            return failures
+
+        try:
+            failures = writeTransaction(db, addBatch)
+        except Exception as error:
+            failures = [(request, error) for request in batch]
+            if debug:
+                traceback.print_exc(file=sys.stderr)
+
+        for request, error in failures:
+            fallBack(request, error)
+        counters.onBatch(len(batch) - len(failures), len(failures))
+    db.close()
+
+
+# Put on the queue of records to tell the writer to stop (see
+# '_writeBatches').
+_stop = object()
+
+
+def _makeHandler(records, counters):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            message = json.loads(self.rfile.read().decode('utf8'))
+            if 'record' in message:
+                records.put(message['record'])
+                counters.onReceived(records.qsize())
+            elif 'stats' in message:
+                snapshot = counters.snapshot(records.qsize())
+                self.wfile.write(json.dumps(snapshot).encode('utf8'))
+
+    return Handler
+
+
+def _removeStaleSocket(path):
+    if not os.path.exists(path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)  # Nobody's home, so it's left over from a dead daemon.
+        return
+    finally:
+        probe.close()
+
+    raise Exception('Another daemon is already listening on {}'.format(path))
+
+
+# Listen on the Unix domain socket at the specified 'path' until interrupted,
+# writing received records to the database at 'dbPath' (by default, the
+# value of $COMPILATION_METRICS_DB).  'addToDatabase(db, request)' adds one
+# record to the database without committing (see 'collect.addToDatabase'),
+# and 'fallBack(request, error)' saves a record that couldn't be written
+# (see 'collect._fallBack').
+#
+def serve(path, addToDatabase, fallBack, dbPath=None, maxBatchSize=500,
+          debug=False):
+    connect(dbPath).close()  # Fail now, rather than in the writer thread.
+
+    records = queue.Queue()
+    counters = Counters()
+
+    writer = threading.Thread(target=_writeBatches,
+                              args=(records, counters, dbPath, addToDatabase,
+                                    fallBack, maxBatchSize, debug))
+    writer.start()
+
+    _removeStaleSocket(path)
+    server = socketserver.ThreadingUnixStreamServer(
+        path, _makeHandler(records, counters))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        # Let the writer write what's left, including the batch that it's
+        # working on, before returning.
+        records.put(_stop)
+        writer.join()
+
+
+if __name__ == '__main__':
+    import argparse
+    import signal
+    from .collect import addToDatabase, _fallBack
+
+    parser = argparse.ArgumentParser(
+        description='Batch compilation records from compiler wrappers into '
+        'the database.')
+    parser.add_argument('--socket',
+                        default=socketPath(),
+                        help='path of the Unix domain socket to listen on '
+                        '(default: ${})'.format(_socketEnvKey))
+    parser.add_argument('--db',
+                        help='path to the database '
+                        '(default: $COMPILATION_METRICS_DB)')
+    parser.add_argument('--max-batch-size', type=int, default=500)
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help="print a running daemon's counters and exit")
+    parser.add_argument('--debug', action='store_true')
+    options = parser.parse_args()
+
+    if not options.socket:
+        parser.error('No socket specified, and the environment variable {} '
+                     'is not set.'.format(_socketEnvKey))
+
+    # Treat termination like an interrupt, so that the socket is cleaned up.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+
+    if options.stats:
+        print(json.dumps(stats(options.socket), indent=4))
+    else:
+        try:
+            serve(options.socket, addToDatabase, _fallBack, options.db,
+                  options.max_batch_size, options.debug)
+        except KeyboardInterrupt:
+            pass
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
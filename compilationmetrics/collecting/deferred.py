@@ -0,0 +1,121 @@
+# Finish work in a detached background process, so that the compiler wrapper
+# can exit as soon as the compiler has.
+#
+# When $COMPILATION_METRICS_DEFER is set to a positive integer N, the work
+# done after a successful compilation (preprocessing the source, asking git
+# about it, and recording the result) happens in a background process, while
+# the wrapper returns the compiler's exit status immediately.  At most N such
+# processes do their work at a time on a host; the rest wait their turn.  The
+# slots are lock files in the "deferred" subdirectory of the cache directory
+# (see 'cache.py').
+#
+# The background process is fully detached: it's in its own session, isn't a
+# child of the wrapper, and its standard streams are /dev/null, so that build
+# tools (which may wait for the wrapper's output pipes to close) don't wait
+# for it.
+
+from .cache import cacheDirectory
+
+import fcntl
+import os
+import sys
+import traceback
+
+_deferEnvKey = 'COMPILATION_METRICS_DEFER'
+
+
+# Return the maximum number of concurrent background processes, or zero if
+# deferring is disabled.
+#
+def maxWorkers():
+    try:
+        return max(0, int(os.environ.get(_deferEnvKey, '0')))
+    except ValueError:
+        return 0
+
+
+# Return an open file that holds one of 'count' slots, waiting for one if
+# they're all taken.  The slot is released when the file is closed (or the
+# process exits).
+#
+def _acquireSlot(count):
+    directory = cacheDirectory('deferred')
+    os.makedirs(directory, exist_ok=True)
+    paths = [
+        os.path.join(directory, 'slot-{}'.format(i)) for i in range(count)
+    ]
+
+    for path in paths:
+        file = open(path, 'a')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return file
+        except BlockingIOError:
+            file.close()
+
+    # All taken.  Wait on one of them, spreading the waiters across slots.
+    file = open(paths[os.getpid() % count], 'a')
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    return file
+
+
+def _redirectStandardStreams():
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+# Call 'function()' in a detached background process, and return in this
+# process without waiting for it.  If 'debug' is true, the background process
+# keeps this process's standard streams, and prints any exception raised by
+# 'function'.
+#
+def runDetached(function, debug=False):
+    # Double fork, so that the background process is adopted by init (or a
+    # subreaper) rather than being left for us to reap.
+    pid = os.fork()
+    if pid != 0:
+        os.waitpid(pid, 0)  # The intermediate child exits right away.
+        return
+
+    try:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+
+        if not debug:
+            _redirectStandardStreams()
+        with _acquireSlot(maxWorkers()):
+            function()
+    except Exception:
+        if debug:
+            traceback.print_exc(file=sys.stderr)
+    finally:
+        # Never return into the caller's code from the background process.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -1,8 +1,26 @@
+# Ask about the git repository containing a file.
+#
+# 'headRevisionAndDiff' is what the compiler wrapper uses.  It avoids running
+# git where it can: it finds the repository by looking for ".git" in the
+# file's directory and its parents, reads HEAD from the repository's files,
+# and remembers the answer in the "git" subdirectory of the cache directory
+# (see 'cache.py') until HEAD or the branch it refers to changes.  It runs
+# "git diff" only when the index suggests that the file has been modified.
+#
+# The other functions run git.
+
 from ..enforce import enforce
+from .cache import cacheDirectory
 
-import subprocess
+import contextlib
+import hashlib
+import json
+import mmap
 import os
-from distutils.spawn import find_executable
+import shutil
+import struct
+import subprocess
+import tempfile
 
 
 def _dirOf(filePath):
@@ -24,7 +42,7 @@ def _callInDirOf(filePath, command):
 
 
 def hasGit():
-    return find_executable('git') is not None
+    return shutil.which('git') is not None
 
 
 def inAnyRepo(filePath):
@@ -46,6 +64,253 @@ def diffHead(filePath):
     return output
 
 
+def _readText(path):
+    with open(path) as file:
+        return file.read().strip()
+
+
+# Return (workTree, gitDir, commonDir) for the repository containing the
+# specified 'directory', or None if there isn't one.  'gitDir' holds HEAD and
+# the index, while 'commonDir' holds the refs.  They differ for worktrees
+# created by "git worktree add".
+#
+def findRepository(directory):
+    while True:
+        dotGit = os.path.join(directory, '.git')
+        gitDir = None
+        if os.path.isdir(dotGit):
+            gitDir = dotGit
+        elif os.path.isfile(dotGit):
+            # A worktree or submodule: ".git" is a file saying where to look.
+            text = _readText(dotGit)
+            if text.startswith('gitdir:'):
+                gitDir = os.path.join(directory, text[len('gitdir:'):].strip())
+
+        if gitDir is not None:
+            commonDir = gitDir
+            with contextlib.suppress(OSError):
+                commonDir = os.path.join(
+                    gitDir, _readText(os.path.join(gitDir, 'commondir')))
+            return directory, os.path.normpath(gitDir), os.path.normpath(
+                commonDir)
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _packedRef(commonDir, ref):
+    with open(os.path.join(commonDir, 'packed-refs')) as file:
+        for line in file:
+            if line.startswith(('#', '^')):
+                continue
+            revision, _, name = line.rstrip('\n').partition(' ')
+            if name == ref:
+                return revision
+    return None
+
+
+# Return (revision, watchedPaths), where 'revision' is what HEAD refers to in
+# the specified repository (or None if it can't be read from the files), and
+# 'watchedPaths' are the files whose modification would change the answer.
+#
+def _readHead(gitDir, commonDir):
+    headPath = os.path.join(gitDir, 'HEAD')
+    head = _readText(headPath)
+    if not head.startswith('ref:'):
+        return head, [headPath]  # detached HEAD
+
+    ref = head[len('ref:'):].strip()
+    loosePath = os.path.join(commonDir, ref)
+    packedPath = os.path.join(commonDir, 'packed-refs')
+    watched = [headPath, loosePath, packedPath]
+    try:
+        return _readText(loosePath), watched
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    with contextlib.suppress(FileNotFoundError):
+        return _packedRef(commonDir, ref), watched
+    return None, watched
+
+
+def _stats(paths):
+    result = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            result.append([path, info.st_mtime_ns, info.st_size])
+        except OSError:
+            result.append([path, None, None])
+    return result
+
+
+def _cachePath(directory):
+    name = hashlib.sha1(directory.encode('utf8')).hexdigest()
+    return cacheDirectory('git', name[:2], name)
+
+
+def _readCache(directory):
+    with contextlib.suppress(OSError, ValueError):
+        with open(_cachePath(directory)) as file:
+            entry = json.load(file)
+        if entry['watched'] == _stats(path for path, _, _ in entry['watched']):
+            return entry
+    return None
+
+
+def _writeCache(directory, entry):
+    with contextlib.suppress(OSError):
+        path = _cachePath(directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w',
+                                         dir=os.path.dirname(path),
+                                         delete=False) as file:
+            json.dump(entry, file)
+        os.replace(file.name, path)
+
+
+# Return a dict describing the repository containing the file at the
+# specified 'realPath' (see '_readCache' and '_writeCache'), or None if there
+# isn't one.
+#
+def _repositoryInfo(realPath):
+    directory = os.path.dirname(realPath)
+    entry = _readCache(directory)
+    if entry is not None:
+        return entry
+
+    found = findRepository(directory)
+    if found is None:
+        return None
+
+    workTree, gitDir, commonDir = found
+    revision, watched = _readHead(gitDir, commonDir)
+    if revision is None:
+        # Maybe there are no commits yet, or the refs are stored in a way we
+        # don't understand.  Ask git, and don't cache its answer.
+        try:
+            rc, output = _callInDirOf(realPath, ['git', 'rev-parse', 'HEAD'])
+        except OSError:
+            rc, output = 1, ''  # no git to ask
+        revision = output if rc == 0 else ''
+        watched = None
+
+    entry = {
+        'workTree': workTree,
+        'gitDir': gitDir,
+        'revision': revision,
+        'watched': watched and _stats(watched)
+    }
+    if watched:
+        _writeCache(directory, entry)
+    return entry
+
+
+_indexEntry = struct.Struct('>10I20sH')  # up to and including the flags
+_extendedFlag = 0x4000
+_assumeValidFlag = 0x8000
+_stageMask = 0x3000
+_nameLengthMask = 0x0FFF
+_fileModes = frozenset([0o100644, 0o100755, 0o120000])
+
+
+# Return the fields of the entry for 'relativePath' (encoded) in the index
+# 'data' as a tuple (ctimeSec, ctimeNsec, mtimeSec, mtimeNsec, dev, ino,
+# mode, uid, gid, size, sha, flags), or None if there's no such entry.
+#
+# Rather than parse every entry before the one we want, look for the path and
+# check that what precedes it is the rest of an entry.  In versions 2 and 3
+# of the index format, an entry is a fixed size header, then (in version 3)
+# possibly two bytes of extended flags, then the NUL terminated path.
+#
+def _findIndexEntry(data, relativePath):
+    nameLength = min(len(relativePath), _nameLengthMask)
+    needle = relativePath + b'\0'
+    position = data.find(needle, 12)
+    while position != -1:
+        for extra in (0, 2):
+            start = position - extra - _indexEntry.size
+            if start < 12:
+                continue
+            fields = _indexEntry.unpack_from(data, start)
+            flags, mode = fields[-1], fields[6]
+            if (flags & _nameLengthMask == nameLength
+                    and bool(flags & _extendedFlag) == bool(extra)
+                    and mode in _fileModes):
+                return fields
+        position = data.find(needle, position + 1)
+    return None
+
+
+# Return whether the index of the repository at 'gitDir' shows that the file
+# at 'filePath' (at 'relativePath' within the work tree) is unmodified, the
+# way "git diff" decides without reading the file: by comparing what the
+# index remembers about the file with what the file system says now.  Return
+# False if not sure.
+#
+def _indexSaysUnmodified(gitDir, filePath, relativePath):
+    indexPath = os.path.join(gitDir, 'index')
+    try:
+        with open(indexPath, 'rb') as file:
+            indexInfo = os.fstat(file.fileno())
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return False
+
+    with data:
+        if data[:4] != b'DIRC' or struct.unpack('>I', data[4:8])[0] not in (
+                2, 3):
+            return False  # version 4 compresses paths; let git handle it
+        fields = _findIndexEntry(data, relativePath.encode('utf8'))
+
+    if fields is None:
+        return True  # untracked, so "git diff" would say nothing
+
+    info = os.lstat(filePath)
+    _, _, mtimeSec, mtimeNsec, _, ino, _, _, _, size, _, flags = fields
+    mtime = mtimeSec * 1000000000 + mtimeNsec
+    if flags & (_assumeValidFlag | _stageMask):
+        return False
+
+    # If the file was modified in the same instant that the index was
+    # written, the index can't tell whether it's been modified since.
+    if mtime >= indexInfo.st_mtime_ns:
+        return False
+
+    if mtimeNsec == 0:
+        # git was built without nanosecond timestamps.
+        sameTime = mtimeSec == info.st_mtime_ns // 1000000000
+    else:
+        sameTime = mtime == info.st_mtime_ns
+
+    return (sameTime and size == info.st_size & 0xFFFFFFFF
+            and ino == info.st_ino & 0xFFFFFFFF)
+
+
+# Return (headRevision, diff) for the specified 'filePath', where 'diff' is
+# the output of "git diff" for the file.  Return ('', '') if the file isn't
+# in a git repository.
+#
+def headRevisionAndDiff(filePath):
+    realPath = os.path.realpath(filePath)
+    repository = _repositoryInfo(realPath)
+    if repository is None:
+        return '', ''
+
+    relativePath = os.path.relpath(realPath, repository['workTree'])
+    relativePath = relativePath.replace(os.sep, '/')
+    if _indexSaysUnmodified(repository['gitDir'], realPath, relativePath):
+        return repository['revision'], ''
+
+    try:
+        rc, output = _callInDirOf(filePath,
+                                  ['git', 'diff', os.path.basename(filePath)])
+    except OSError:
+        return repository['revision'], ''  # no git to ask
+    return repository['revision'], output if rc == 0 else ''
+
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) < 2:
@@ -0,0 +1,225 @@
+# Attribute a translation unit's preprocessed size to the headers it includes.
+#
+# The preprocessor's output (e.g. "gcc -E") is annotated with linemarkers,
+# lines of the form
+#
+#     # 42 "/usr/include/stdio.h" 1 3 4
+#
+# meaning that what follows comes from line 42 of the named file.  A flag of
+# "1" means that the file was just entered (included), and a flag of "2"
+# means that the preprocessor has returned to the file after an inclusion.
+# Following the markers while counting the bytes between them tells us how
+# much of the output each header contributed, both by itself ("self") and
+# together with everything that it included ("inclusive").
+#
+# This piggybacks on the preprocessing that's done anyway to measure the
+# preprocessed size of each source (see 'collect._preprocessSource'), so it
+# costs no extra compiler invocation.  It does cost some time spent in python
+# per linemarker, so it's off unless $COMPILATION_METRICS_INCLUDES is "1".
+#
+# The result is a list of headers, each a list:
+#
+#     [path, includedByPath, depth, includeCount, selfBytes, inclusiveBytes]
+#
+# where 'includedByPath' is the header that first included this one, or None
+# if it was included by the source file itself (or by the command line, as
+# with "stdc-predef.h"), and 'depth' is 1 for a header included by the source
+# file, 2 for a header included by one of those, etc.
+
+import os
+import re
+
+_enabledEnvKey = 'COMPILATION_METRICS_INCLUDES'
+
+_chunkSize = 8 * 1024 * 1024
+
+_linemarker = re.compile(
+    br'^# [0-9]+ "((?:[^"\\\n]|\\.)*)"((?: [0-9]+)*)\r?$', re.MULTILINE)
+
+_escape = re.compile(br'\\(?:([0-7]{1,3})|(.))')
+
+
+def enabled():
+    return os.environ.get(_enabledEnvKey, '0') == '1'
+
+
+def _unescape(name):
+    # Preprocessors escape backslashes and quotes, and GCC writes
+    # unprintable bytes as octal escapes.
+    def replace(match):
+        octal, char = match.groups()
+        return bytes([int(octal, 8) & 0xff]) if octal else char
+
+    return _escape.sub(replace, name).decode('utf8', 'surrogateescape')
+
+
+class _Frame(object):
+    __slots__ = ('path', 'bytes')
+
+    def __init__(self, path):
+        self.path = path
+        self.bytes = 0  # including the headers that this one included
+
+
+# Follow the linemarkers in the preprocessor output fed to it, and tally the
+# bytes contributed by each header.
+#
+class Tracer(object):
+    def __init__(self, directory=None):
+        self._directory = directory or os.getcwd()
+        self._stack = [_Frame(None)]  # bottom is the source (or <built-in>)
+        self._active = {}  # {path: number of frames on the stack}
+        self._headers = {}  # {path: [path, includedBy, depth, count, ...]}
+        self._paths = {}  # {raw name: normalized path}
+
+    def _path(self, rawName):
+        path = self._paths.get(rawName)
+        if path is None:
+            name = _unescape(rawName)
+            if not name.startswith('<'):
+                name = os.path.normpath(os.path.join(self._directory, name))
+            path = self._paths[rawName] = name
+        return path
+
+    def _attribute(self, byteCount):
+        frame = self._stack[-1]
+        frame.bytes += byteCount
+        if len(self._stack) > 1:
+            self._headers[frame.path][4] += byteCount
+
+    def _push(self, path):
+        parent = self._stack[-1]
+        depth = len(self._stack)
+        header = self._headers.get(path)
+        if header is None:
+            includedBy = parent.path if depth > 1 else None
+            header = self._headers[path] = [path, includedBy, depth, 0, 0, 0]
+        header[3] += 1
+        self._stack.append(_Frame(path))
+        self._active[path] = self._active.get(path, 0) + 1
+
+    def _pop(self):
+        frame = self._stack.pop()
+        self._stack[-1].bytes += frame.bytes
+        self._active[frame.path] -= 1
+        # A header that (directly or not) includes itself is counted once.
+        if self._active[frame.path] == 0:
+            self._headers[frame.path][5] += frame.bytes
+
+    def _returnTo(self, path):
+        # Normally this pops exactly one frame, but be lenient with output
+        # that's missing a marker.
+        if len(self._stack) > 1:
+            self._pop()
+        while len(self._stack) > 1 and self._stack[-1].path != path:
+            self._pop()
+        if len(self._stack) == 1:
+            self._stack[0].path = path
+
+    # Account for the specified 'data', which ends at a line boundary, and
+    # which begins at a line boundary in the output fed so far.
+    #
+    def feed(self, data):
+        position = 0
+        for match in _linemarker.finditer(data):
+            start = match.start()
+            self._attribute(start - position)
+            position = start
+
+            path = self._path(match.group(1))
+            flags = match.group(2).split()
+            if b'1' in flags:
+                self._push(path)
+            elif b'2' in flags:
+                self._returnTo(path)
+            elif len(self._stack) == 1:
+                self._stack[0].path = path
+            else:
+                # A marker changing the line (or the presumed name) of the
+                # current header.  Keep attributing to the header.
+                pass
+        self._attribute(len(data) - position)
+
+    # Return the list of headers described at the top of this file.
+    #
+    def finish(self):
+        while len(self._stack) > 1:
+            self._pop()
+        return list(self._headers.values())
+
+
+# Return (sizeBytes, lineCount, headers) for the preprocessor output read
+# from the specified binary 'stream', where 'headers' is as described at the
+# top of this file.  Relative paths in the output are relative to the
+# specified 'directory' (by default, the current directory).
+#
+def traceStream(stream, directory=None, chunkSize=_chunkSize):
+    tracer = Tracer(directory)
+    sizeBytes = 0
+    lineCount = 0
+    pending = b''
+    while True:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            break
+        sizeBytes += len(chunk)
+        lineCount += chunk.count(b'\n')
+
+        # Only feed the tracer whole lines, so that no marker is split.
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            pending += chunk
+            continue
+        tracer.feed(pending + chunk[:end])
+        pending = chunk[end:]
+
+    if pending:
+        lineCount += 1  # a final line without a newline
+        tracer.feed(pending)
+
+    return sizeBytes, lineCount, tracer.finish()
+
+
+if __name__ == '__main__':
+    import sys
+    import subprocess
+
+    if len(sys.argv) < 2:
+        sys.exit('usage: {} COMPILER [ARGS...] SOURCE'.format(sys.argv[0]))
+
+    # Preprocess the source and print its headers, biggest first.
+    child = subprocess.Popen(sys.argv[1:2] + ['-E'] + sys.argv[2:],
+                             stdout=subprocess.PIPE)
+    with child.stdout:
+        sizeBytes, lineCount, headers = traceStream(child.stdout)
+    child.wait()
+
+    print('{} bytes, {} lines'.format(sizeBytes, lineCount))
+    print('{:>10} {:>10} {:>6} {:>5}  {}'.format('inclusive', 'self', 'count',
+                                                 'depth', 'header'))
+    for path, _, depth, count, selfBytes, inclusiveBytes in sorted(
+            headers, key=lambda header: header[5], reverse=True):
+        print('{:>10} {:>10} {:>6} {:>5}  {}'.format(inclusiveBytes,
+                                                     selfBytes, count, depth,
+                                                     path))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,114 @@
+# Remember the key of this machine's row in the Machine table of each
+# database, so that the compiler wrapper can add a compilation without
+# looking the machine up (see 'collect.addToDatabase').  A machine's
+# description (see 'collect._machineInfo') hardly ever changes, and when it
+# does, it's a different machine as far as the cache is concerned.
+#
+# Each key is kept in a file under the cache directory (see 'cache.py')
+# whose name is a hash of the database file's real path, device, and inode,
+# and of the machine's description.  The file also holds the Machine row's
+# IdentityHash (see 'write.machineIdentityHash').  A cached key is used only
+# if the database has a Machine with that key and that hash, which costs one
+# lookup by primary key instead of a search of the table.  So a cache file
+# that outlived its database's contents, e.g. because the database was
+# restored from a backup in place, where the key might since have been given
+# to another machine, is detected, deleted, and replaced.
+#
+# $COMPILATION_METRICS_MACHINE_KEY_CACHE=0 disables the cache.
+
+from .cache import cacheDirectory
+from ..database.tables import identityHash
+from ..database.write import machineIdentityHash
+
+import contextlib
+import os
+import tempfile
+
+_enabledEnvKey = 'COMPILATION_METRICS_MACHINE_KEY_CACHE'
+
+
+def _enabled():
+    return os.environ.get(_enabledEnvKey, '1') != '0'
+
+
+# Return the path to the cache file for the specified 'machineInfo' in the
+# database 'db', or None if 'db' isn't a file.
+#
+def _cachePath(db, machineInfo):
+    path = None
+    for _, name, file in db.execute('pragma database_list;'):
+        if name == 'main':
+            path = file
+    if not path:
+        return None  # in memory or temporary
+
+    realPath = os.path.realpath(path)
+    info = os.stat(realPath)
+    name = identityHash([
+        realPath, info.st_dev, info.st_ino,
+        identityHash(sorted(machineInfo.items()))
+    ])
+    return cacheDirectory('machine-keys', name)
+
+
+# Return the cached key of the Machine described by the specified
+# 'machineInfo' in the database 'db', or None if it's not cached, or if the
+# database doesn't agree with the cache (in which case the cache file is
+# deleted).
+#
+def cachedKey(db, machineInfo):
+    if not _enabled():
+        return None
+    with contextlib.suppress(OSError, ValueError):
+        path = _cachePath(db, machineInfo)
+        if path is None:
+            return None
+        with open(path) as file:
+            key, hash = file.read().split()
+        key = int(key)
+        if hash == machineIdentityHash(machineInfo):
+            found = db.execute(
+                'select count(*) from Machine '
+                'where Key = ? and IdentityHash = ?;', (key, hash))
+            if found.fetchone() == (1, ):
+                return key
+        os.remove(path)
+    return None
+
+
+def remember(db, machineInfo, key):
+    if not _enabled():
+        return
+    with contextlib.suppress(OSError):
+        path = _cachePath(db, machineInfo)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w',
+                                         dir=os.path.dirname(path),
+                                         delete=False) as file:
+            file.write('{} {}'.format(key, machineIdentityHash(machineInfo)))
+        os.replace(file.name, path)
+
+
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -24,7 +24,7 @@ void usage(std::ostream& out, const char* argv0) {
         << indent << indent << "Run COMMAND and write its resource consumption as JSON to URI,\n"
         << indent << indent << "where URI is either of the form \"file:///path/to/file\" or \n"
         << indent << indent << "\"fd://integer_file_descriptor\".  The path to the COMMAND must \n"
-        << indent << indent << "be fully qualified.\n\n"
+        << indent << indent << "be fully qualified.  Exit with the status of COMMAND.\n\n"
         << indent << argv0 << " --help\n"
         << indent << argv0 << " -h\n"
         << indent << indent << "Print this message.\n\n";
@@ -98,6 +98,10 @@ int wait_and_measure_child(int pid, int reporting_fd) {
         << ENTRY(ru_maxrss) << ",\n"
         << ENTRY(ru_inblock) << ",\n"
         << ENTRY(ru_oublock) << ",\n"
+        << ENTRY(ru_minflt) << ",\n"
+        << ENTRY(ru_majflt) << ",\n"
+        << ENTRY(ru_nvcsw) << ",\n"
+        << ENTRY(ru_nivcsw) << ",\n"
         << ENTRY(ru_nswap) << "\n"
         << "}";
     
@@ -118,6 +122,13 @@ int wait_and_measure_child(int pid, int reporting_fd) {
         buffer += rcode;
     }
 
+    // Exit the way the child did, so that our caller sees the command's
+    // status rather than our own.
+    if (WIFEXITED(status)) {
+        return WEXITSTATUS(status);
+    } else if (WIFSIGNALED(status)) {
+        return 128 + WTERMSIG(status);
+    }
     return 0;
 }
 
@@ -1,22 +1,149 @@
 # Measure resources used by a subprocess.
 #
-# This module uses a helper executable, `measure`, expected to be in the same
-# directory as this script.  The repository's `Makefile` compiles the helper.
+# There are two ways of measuring, selected by the environment variable
+# $COMPILATION_METRICS_MEASURE:
+#
+# - "helper" (the default) runs the command under a helper executable,
+#   described below.
+# - "wait4" runs the command directly and gets its resource usage from
+#   `os.wait4` when reaping it.  This saves a process per command, but note
+#   that Linux carries a process's peak resident memory across `exec`, so the
+#   command's `maxResidentMemoryBytes` is never less than that of this python
+#   process at the time of the fork.  For all but the smallest compilations,
+#   the compiler's own peak is larger anyway.
+#
+# Both report the same resource usage (see `formatUsage`).
+#
+# Either way, the caller can ask for a copy of the command's standard error
+# (see `call`), e.g. to parse a report that the compiler writes there.  The
+# output still reaches our standard error unchanged, but through a pipe, so
+# the command no longer sees a terminal there.
+#
+# The helper executable, `measure`, is packaged alongside this
+# script.  The repository's `Makefile` compiles the helper, and records its
+# SHA-256 digest in `measure.sha256`.
+#
+# Rather than writing the helper to a temporary file for every compilation,
+# it's installed once into the cache directory (see `cache.py`) under a name
+# that includes its digest, and reused from there.  If the cache directory
+# can't be written, or its file system doesn't allow executing files, the
+# helper is executed from an anonymous in-memory file instead (see
+# `_memfdExe`), and failing that, from a temporary file as before.
 
 from ..enforce import enforce
+from .cache import cacheDirectory
 
+from contextlib import contextmanager
 import datetime
+import functools
 import json
 import os
-from pathlib import Path
-import pkgutil
-from pathlib import Path
 import subprocess
-import tempfile
 import time
 
 utcnow = datetime.datetime.utcnow
-measure_exe_data = pkgutil.get_data('compilationmetrics.collecting', 'measure')
+
+
+# Return the contents of the specified file packaged alongside this module,
+# whether it's in a directory or a zip archive.  This is what
+# `pkgutil.get_data` does, without the cost of importing `pkgutil`.
+#
+def _packageData(name):
+    return __loader__.get_data(os.path.join(os.path.dirname(__file__), name))
+
+
+@functools.lru_cache(maxsize=None)
+def _measureExeData():
+    return _packageData('measure')
+
+
+def _measureExeDigest():
+    try:
+        digest = _packageData('measure.sha256')
+        return digest.decode('ascii').split()[0]
+    except (OSError, IndexError):
+        # No precomputed digest (e.g. running from a source tree), so
+        # compute it.
+        import hashlib
+        return hashlib.sha256(_measureExeData()).hexdigest()
+
+
+# Each of the following context managers yields a pair (exePath, fds), where
+# 'exePath' is a path from which the helper can be executed (or None if the
+# method is unavailable), and 'fds' is a tuple of file descriptors that the
+# child process must inherit in order for 'exePath' to work.
+
+
+@contextmanager
+def _cachedExe():
+    path = cacheDirectory('measure-' + _measureExeDigest())
+    if not os.access(path, os.X_OK):
+        import tempfile
+        try:
+            # Install it under a temporary name, and then rename it into
+            # place, so that concurrent wrappers never see a partial file.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                             delete=False) as exe:
+                exe.write(_measureExeData())
+            os.chmod(exe.name, 0o755)
+            os.replace(exe.name, path)
+        except OSError:
+            yield None, ()
+            return
+
+    yield path, ()
+
+
+@contextmanager
+def _memfdExe():
+    if not hasattr(os, 'memfd_create'):
+        yield None, ()
+        return
+
+    fd = os.memfd_create('measure')
+    try:
+        os.write(fd, _measureExeData())
+        # This is what fexecve(3) does: the child execs its own inherited
+        # copy of the file descriptor via /proc.
+        yield '/proc/self/fd/{}'.format(fd), (fd, )
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _tempfileExe():
+    import tempfile
+    exe = tempfile.NamedTemporaryFile(delete=False)
+    exe.write(_measureExeData())
+    exe.close()
+    os.chmod(exe.name, 0o700)
+    try:
+        yield exe.name, ()
+    finally:
+        os.unlink(exe.name)
+
+
+# Start the helper with the specified 'args', trying each of the ways of
+# providing its executable in turn.  Return (child, startDatetime).  Once
+# `Popen` returns, the helper has been exec'd, and so the executable is no
+# longer needed.  'stderr' is as for `Popen`.
+#
+def _spawnMeasureExe(args, pass_fds, stderr=None):
+    for provideExe in (_cachedExe, _memfdExe, _tempfileExe):
+        with provideExe() as (exe_path, exe_fds):
+            if exe_path is None:
+                continue
+            try:
+                start = utcnow()
+                child = subprocess.Popen([exe_path, *args],
+                                         pass_fds=pass_fds + exe_fds,
+                                         stderr=stderr)
+                return child, start
+            except PermissionError:
+                continue  # e.g. the file system is mounted "noexec"
+
+    enforce(False, 'Unable to execute the measure helper.')
 
 
 def timeval_to_seconds(timeval):
@@ -24,20 +151,143 @@ def timeval_to_seconds(timeval):
     return sec + usec / 1000000
 
 
+def seconds_to_timeval(seconds):
+    usec = round(seconds * 1000000)
+    return {'tv_sec': usec // 1000000, 'tv_usec': usec % 1000000}
+
+
 def formatUsage(data):
     return {
         'userCpuTime': timeval_to_seconds(data['ru_utime']),
         'systemCpuTime': timeval_to_seconds(data['ru_stime']),
         'maxResidentMemoryBytes': data['ru_maxrss'] * 1024,
         'blockingInputOperations': data['ru_inblock'],
-        'blockingOutputOperations': data['ru_oublock']
+        'blockingOutputOperations': data['ru_oublock'],
+        'minorPageFaults': data['ru_minflt'],
+        'majorPageFaults': data['ru_majflt'],
+        'swaps': data['ru_nswap'],
+        'voluntaryContextSwitches': data['ru_nvcsw'],
+        'involuntaryContextSwitches': data['ru_nivcsw']
     }
 
 
+# Return the `resource.struct_rusage` returned by `os.wait4` in the form that
+# the helper writes as JSON.
+#
+def _rusageToDict(rusage):
+    data = {name: getattr(rusage, name) for name in _rusageCounts}
+    data['ru_utime'] = seconds_to_timeval(rusage.ru_utime)
+    data['ru_stime'] = seconds_to_timeval(rusage.ru_stime)
+    return data
+
+
+_rusageCounts = ('ru_maxrss', 'ru_inblock', 'ru_oublock', 'ru_minflt',
+                 'ru_majflt', 'ru_nswap', 'ru_nvcsw', 'ru_nivcsw')
+
+# The resource usage of a command that couldn't be started, in the form that
+# the helper writes as JSON.
+_noUsage = {
+    **dict.fromkeys(_rusageCounts, 0), 'ru_utime': seconds_to_timeval(0),
+    'ru_stime': seconds_to_timeval(0)
+}
+
+
+def _exitCode(status):
+    # Like a shell, report death by signal N as 128 + N.
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+_backendEnvKey = 'COMPILATION_METRICS_MEASURE'
+
+
+def _backend():
+    backend = os.environ.get(_backendEnvKey, 'helper')
+    enforce(backend in _backends,
+            'Unknown {} "{}"'.format(_backendEnvKey, backend))
+    return backend
+
+
+def _writeAll(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+# Start and return a thread that copies everything written to the specified
+# 'pipe' (a child's standard error) to our standard error, and also to the
+# specified 'tee' (a binary file-like object).  If 'tee' is None, there's
+# nothing to do, and return None.
+#
+def _startTee(pipe, tee):
+    if tee is None:
+        return None
+
+    import threading
+
+    def copy():
+        with pipe:
+            while True:
+                chunk = os.read(pipe.fileno(), 65536)
+                if not chunk:
+                    return
+                _writeAll(2, chunk)
+                tee.write(chunk)
+
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.start()
+    return thread
+
+
+def _stderrFor(tee):
+    return subprocess.PIPE if tee is not None else None
+
+
+def _joinTee(thread):
+    if thread is not None:
+        thread.join()
+
+
 # Returns (returnCode, startDatetime, wallTimeDurationSeconds, ResourceUsage)
 #
-def call(command):
-    # Run the command in a wrapper (`measure_exe`).  The wrapper takes an
+# If 'stderrTee' is not None, it's a binary file-like object to which a copy
+# of the command's standard error is written.
+#
+# If 'onSpawn' is not None, it's called with the process ID of the child as
+# soon as the child exists.  For the "helper" backend, that's the helper,
+# whose child runs the command (see 'usesHelper').
+#
+def call(command, stderrTee=None, onSpawn=None):
+    return _backends[_backend()](command, stderrTee, onSpawn)
+
+
+def _callWait4(command, stderrTee=None, onSpawn=None):
+    # Reap the child ourselves with `os.wait4`, which also gives us the
+    # resources used by it and by whichever of its descendants it waited for,
+    # e.g. the compiler driver's `cc1plus`, `as`, and `ld`.  Then tell the
+    # `Popen` object, so that it doesn't try to reap the child again.
+    start = utcnow()
+    try:
+        child = subprocess.Popen(command, stderr=_stderrFor(stderrTee))
+    except (FileNotFoundError, PermissionError) as error:
+        # Like a shell, report a command that isn't there as 127 and one
+        # that can't be executed as 126, rather than raising.
+        os.write(2, '{}: {}\n'.format(command[0], error.strerror).encode())
+        rc = 127 if isinstance(error, FileNotFoundError) else 126
+        return rc, start, 0.0, formatUsage(_noUsage)
+    if onSpawn is not None:
+        onSpawn(child.pid)
+    tee = _startTee(child.stderr, stderrTee)
+    _, status, rusage = os.wait4(child.pid, 0)
+    duration = (utcnow() - start).total_seconds()
+    child.returncode = rc = _exitCode(status)
+    _joinTee(tee)
+
+    return rc, start, duration, formatUsage(_rusageToDict(rusage))
+
+
+def _callHelper(command, stderrTee=None, onSpawn=None):
+    # Run the command in a wrapper (`measure`).  The wrapper takes an
     # argument naming a file descriptor that it will write the resource usage
     # to as JSON.
     #
@@ -56,28 +306,37 @@ def call(command):
     #
     # Separately, keep track of the total wall time taken by the child process.
 
-    exe = tempfile.NamedTemporaryFile(delete=False)
-    exe.write(measure_exe_data)
-    exe.close()
-    exe_path = Path(exe.name)
-    exe_path.chmod(0o700)
-        
-    try:
-        pipe_read_end, pipe_write_end = os.pipe()
-        command = [exe_path, f'fd://{pipe_write_end}', *command]
-        start = utcnow()
-        child = subprocess.Popen(command, pass_fds=(pipe_write_end, ))
-        os.close(pipe_write_end)  # so that only the child's copy of the fd is open
-        rusage_json = os.fdopen(pipe_read_end).read()
-        rc = child.wait()
-        duration = (utcnow() - start).total_seconds()
-        rusage_dict = json.loads(rusage_json)
-    finally:
-        exe_path.unlink()
-        
+    pipe_read_end, pipe_write_end = os.pipe()
+    with os.fdopen(pipe_read_end) as pipe_reader:
+        try:
+            child, start = _spawnMeasureExe(
+                [f'fd://{pipe_write_end}', *command],
+                pass_fds=(pipe_write_end, ),
+                stderr=_stderrFor(stderrTee))
+        finally:
+            os.close(pipe_write_end)  # so that only the child's copy is open
+        if onSpawn is not None:
+            onSpawn(child.pid)
+        tee = _startTee(child.stderr, stderrTee)
+        rusage_json = pipe_reader.read()
+    rc = child.wait()
+    duration = (utcnow() - start).total_seconds()
+    _joinTee(tee)
+    rusage_dict = json.loads(rusage_json)
+
     return rc, start, duration, formatUsage(rusage_dict)
 
 
+_backends = {'wait4': _callWait4, 'helper': _callHelper}
+
+
+# Return whether 'call' runs the command as a child of the helper, rather
+# than directly.
+#
+def usesHelper():
+    return _backend() == 'helper'
+
+
 if __name__ == '__main__':
     import sys
     rc, start, duration, usage = call(sys.argv[1:])
@@ -0,0 +1,98 @@
+# Time the phases of the compiler wrapper's own work, so that its overhead
+# can be stored with each compilation (see the WrapperOverhead table in
+# 'database/tables.py').
+#
+# Phases are timed with the monotonic clock and recorded in this module, for
+# the one compilation that the process is wrapping.  'take' returns them as a
+# list
+#
+#     [[phase, seconds], ...]
+#
+# in the order in which they were first recorded, with the times of a phase
+# recorded more than once added up.
+#
+# The phases are:
+#
+# - "startup": from the start of the process (according to /proc) until
+#   'collect.collect' was called, i.e. the interpreter's startup and imports.
+# - "measure": the time spent in 'measure.call' beyond the compiler's own
+#   lifetime, e.g. starting the helper.
+# - "count": counting the source file's bytes and lines.
+# - "preprocess": preprocessing the source (or looking it up in the cache).
+# - "git": finding the source file's revision and diff.
+# - "connect": opening the database, when writing to it directly.
+# - "createEntry": adding the compilation to the database, likewise.
+# - "commit": committing the transaction that added the compilation.  Since
+#   the record is part of that transaction, this phase is added to it in a
+#   second, small transaction (see 'collect.writeToDatabase').
+
+import time
+
+_phases = {}  # {phase: seconds}, in order of insertion
+
+
+def add(phase, seconds):
+    _phases[phase] = _phases.get(phase, 0) + seconds
+
+
+# Record the time taken by the body of a 'with' statement as the specified
+# 'phase'.
+#
+class timing(object):
+    def __init__(self, phase):
+        self._phase = phase
+
+    def __enter__(self):
+        self._start = time.monotonic()
+
+    def __exit__(self, *exception):
+        add(self._phase, time.monotonic() - self._start)
+
+
+# Return the number of seconds since this process started, or None if that
+# isn't known.
+#
+def secondsSinceProcessStart():
+    # The 22nd field of /proc/self/stat is when the process started, in
+    # clock ticks since boot.
+    import os
+
+    try:
+        with open('/proc/self/stat', 'rb') as file:
+            data = file.read()
+        ticks = int(data[data.rindex(b')') + 2:].split()[19])
+        started = ticks / os.sysconf('SC_CLK_TCK')
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# Return the phases described at the top of this file, and forget them.
+#
+def take():
+    phases = [[phase, seconds] for phase, seconds in _phases.items()]
+    _phases.clear()
+    return phases
+
+
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
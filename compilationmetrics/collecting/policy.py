@@ -0,0 +1,107 @@
+# Decide which compilations to record, and in how much detail.
+#
+# By default every successful compilation is recorded in full.  A large
+# build farm doesn't need that, and most compilations are quick ones that
+# aren't interesting individually.  The following environment variables
+# change the policy:
+#
+# - $COMPILATION_METRICS_RECORD_ONE_IN=N records one in N compilations.  The
+#   choice is made by a hash of the source file's path, so a given source
+#   file is either always recorded or never, and reports that compare one
+#   build with another see the same files.
+#
+# - $COMPILATION_METRICS_RECORD_SECONDS=X records every compilation that took
+#   at least X seconds, whether or not it was chosen by the hash.
+#
+# - $COMPILATION_METRICS_RECORD_MAXRSS_MIB=Y records every compilation whose
+#   peak resident memory was at least Y mebibytes, likewise.
+#
+# - $COMPILATION_METRICS_DETAIL_SECONDS=Z skips the expensive parts of
+#   collecting (preprocessing the source and asking git about it) unless the
+#   compilation took at least Z seconds.  Compilations recorded without them
+#   have null preprocessed sizes and an empty git revision.
+#
+# Each recorded compilation has a "sample weight": the number of compilations
+# that it stands for.  That's N for a compilation recorded because it was
+# chosen by the hash, and 1 for one recorded because it crossed a threshold
+# (since every such compilation is recorded).  Multiplying by the weight
+# (CompilationView.Weight) estimates totals over all compilations, e.g.
+#
+#     select sum(CpuTime * Weight) from CompilationView;
+
+import os
+import zlib
+
+_oneInEnvKey = 'COMPILATION_METRICS_RECORD_ONE_IN'
+_secondsEnvKey = 'COMPILATION_METRICS_RECORD_SECONDS'
+_maxrssEnvKey = 'COMPILATION_METRICS_RECORD_MAXRSS_MIB'
+_detailEnvKey = 'COMPILATION_METRICS_DETAIL_SECONDS'
+
+
+def _number(envKey, constructor, default):
+    try:
+        return constructor(os.environ.get(envKey, default))
+    except ValueError:
+        return constructor(default)
+
+
+def _isChosen(sourcePath, oneIn):
+    # CRC-32 isn't a cryptographic hash, but it's well mixed enough for this,
+    # and it's in 'zlib', which is cheap to import.
+    data = sourcePath.encode('utf8', 'surrogateescape')
+    return zlib.crc32(data) % oneIn == 0
+
+
+# Return (sampleWeight, detailed) for a compilation of the specified
+# 'sourcePath' that took the specified 'durationSeconds' and used the
+# specified 'resources' (see 'measure.formatUsage'), or None if the
+# compilation isn't to be recorded.  'detailed' is whether to preprocess the
+# source and consult git.
+#
+def decide(sourcePath, durationSeconds, resources):
+    oneIn = max(1, _number(_oneInEnvKey, int, '1'))
+    recordSeconds = _number(_secondsEnvKey, float, 'inf')
+    recordMebibytes = _number(_maxrssEnvKey, float, 'inf')
+    detailSeconds = _number(_detailEnvKey, float, '0')
+
+    mebibytes = resources['maxResidentMemoryBytes'] / (1024 * 1024)
+    if durationSeconds >= recordSeconds or mebibytes >= recordMebibytes:
+        weight = 1
+    elif _isChosen(sourcePath, oneIn):
+        weight = oneIn
+    else:
+        return None
+
+    return weight, durationSeconds >= detailSeconds
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Print which of the specified source paths would be recorded if their
+    # compilations were quick.
+    for path in sys.argv[1:]:
+        decision = decide(os.path.abspath(path), 0,
+                          {'maxResidentMemoryBytes': 0})
+        print(path, 'skipped' if decision is None else decision)
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
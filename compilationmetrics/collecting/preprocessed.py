@@ -0,0 +1,211 @@
+# Cache the size, line count, and (optionally) included headers of
+# preprocessed sources, so that the compiler's preprocessor needn't be run
+# again for a source whose inputs haven't changed since it was last measured.
+#
+# Entries are keyed on the working directory and the command used to
+# preprocess the source.  Each entry records a fingerprint of the source and
+# of every header it included, as listed in the dependency file that the
+# compiler writes when given "-MD" or "-MMD".  The fingerprint is made from
+# the path, modification time, and size of each of those files.  Commands
+# that don't produce a dependency file can't be cached, because there'd be
+# no way to tell when one of their headers changed.
+#
+# The cache lives in the "preprocessed" subdirectory of the cache directory
+# (see 'cache.py'), along with a file of counters describing how well it's
+# doing:
+#
+#     $ python3 -m compilationmetrics.collecting.preprocessed
+#
+# Set $COMPILATION_METRICS_PREPROCESSED_CACHE to "0" to disable the cache.
+
+from .cache import cacheDirectory
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+_enabledEnvKey = 'COMPILATION_METRICS_PREPROCESSED_CACHE'
+
+
+def _enabled():
+    return os.environ.get(_enabledEnvKey, '1') != '0'
+
+
+def _cachePath(*parts):
+    return cacheDirectory('preprocessed', *parts)
+
+
+# Return the list of prerequisites of the first rule in the specified make
+# 'text', e.g. as written by "gcc -MD".
+#
+def parseDependencies(text):
+    text = text.replace('\\\n', ' ')
+    firstRule = text.split('\n', 1)[0]
+
+    words = []
+    word = []
+    chars = iter(firstRule)
+    for char in chars:
+        if char == '\\':
+            escaped = next(chars, '')
+            if escaped in ' #':
+                word.append(escaped)
+            else:
+                word.extend([char, escaped])
+        elif char == '$':
+            # "$$" is an escaped "$".
+            word.append(next(chars, ''))
+        elif char in ' \t':
+            if word:
+                words.append(''.join(word))
+                word = []
+        else:
+            word.append(char)
+    if word:
+        words.append(''.join(word))
+
+    # The first word(s) up to the one ending in ":" are the targets.
+    for i, word in enumerate(words):
+        if word.endswith(':'):
+            return words[i + 1:]
+    return []
+
+
+def _fingerprint(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        info = os.stat(path)
+        digest.update('{}\0{}\0{}\0'.format(path, info.st_mtime_ns,
+                                            info.st_size).encode('utf8'))
+    return digest.hexdigest()
+
+
+def _key(cmd):
+    text = json.dumps([os.getcwd(), list(cmd)])
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+def _readEntry(key):
+    try:
+        with open(_cachePath(key[:2], key)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _writeEntry(key, entry):
+    path = _cachePath(key[:2], key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w',
+                                     dir=os.path.dirname(path),
+                                     delete=False) as file:
+        json.dump(entry, file)
+    os.replace(file.name, path)
+
+
+# Add the specified 'increments' to the counters file.  A missing or
+# corrupt counters file starts over from zero.
+#
+def _count(**increments):
+    path = _cachePath('counters.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        file.seek(0)
+        try:
+            counters = json.load(file)
+        except ValueError:
+            counters = {}
+        for name, increment in increments.items():
+            counters[name] = counters.get(name, 0) + increment
+        file.seek(0)
+        file.truncate()
+        json.dump(counters, file)
+
+
+def counters():
+    try:
+        with open(_cachePath('counters.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Return (preprocessedSizeBytes, preprocessedLineCount, includes) for the
+# source compiled by the specified 'cmd', which has just finished.
+# 'preprocess' is a function that takes the command that will preprocess the
+# source and whether to trace its includes, and returns the triple, where
+# 'includes' is None unless 'traceIncludes' (see 'includes.py').  The cache is
+# consulted first, and 'preprocess' is called only if the source or one of
+# its headers has changed.
+#
+def metrics(cmd, preprocessCmd, preprocess, traceIncludes=False):
+    if not _enabled():
+        return preprocess(preprocessCmd, traceIncludes)
+
+    try:
+        depPath = cmd.dependencyPath()
+        with open(depPath) as depFile:
+            inputs = [cmd.sourcePath()] + parseDependencies(depFile.read())
+        fingerprint = _fingerprint(inputs)
+    except Exception:
+        # No dependency file (or one of the inputs has gone missing), so we
+        # can't tell whether a cached result is still good.
+        with contextlib.suppress(OSError):
+            _count(uncacheable=1)
+        return preprocess(preprocessCmd, traceIncludes)
+
+    key = _key(preprocessCmd)
+    entry = _readEntry(key)
+    if (entry is not None and entry.get('fingerprint') == fingerprint
+            and (not traceIncludes or entry.get('includes') is not None)):
+        with contextlib.suppress(OSError):
+            _count(hits=1, savedSeconds=entry['seconds'])
+        includes = entry.get('includes') if traceIncludes else None
+        return entry['sizeBytes'], entry['lineCount'], includes
+
+    before = time.monotonic()
+    sizeBytes, lineCount, includes = preprocess(preprocessCmd, traceIncludes)
+    seconds = time.monotonic() - before
+
+    with contextlib.suppress(OSError):
+        _writeEntry(
+            key, {
+                'fingerprint': fingerprint,
+                'sizeBytes': sizeBytes,
+                'lineCount': lineCount,
+                'includes': includes,
+                'seconds': seconds
+            })
+        _count(misses=1, missSeconds=seconds)
+
+    return sizeBytes, lineCount, includes
+
+
+if __name__ == '__main__':
+    print(json.dumps(counters(), indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,283 @@
+# Replay the compilations listed in a compilation database
+# ("compile_commands.json", as written by CMake, Bear, etc.), measuring each
+# as the compiler wrapper would (see 'collect.py'), and record them in a
+# database of their own.
+#
+# This is for benchmarks: measuring a compiler upgrade, a change of flags, or
+# a refactoring on a quiet machine, rather than inferring it from noisy
+# production builds.  Replay runs the listed compilations in a pool of
+# --jobs worker processes, optionally pinned to --cpus, and does so --repeat
+# times, so that the variance of each compilation can be estimated.  Given
+# more than one --compiler, every compilation is run with each compiler in
+# turn (the compilation database's own compiler is replaced), interleaving
+# the compilers across repetitions so that drift in the machine's state
+# affects them alike.
+#
+# Each pass over the compilation database with one compiler is recorded as a
+# build (see 'build.py') whose Tool is "replay" and whose identifier is
+#
+#     NAME/COMPILER/REPETITION
+#
+# so that benchmark runs can be told apart from real builds, compared with
+# each other, and analyzed as builds (see 'database/builds.py').  The
+# compilations are written to the database by the replaying process, not by
+# the workers, so the workers never wait on the database.
+#
+# Usage:
+#
+#     $ python3 -m compilationmetrics.collecting.replay compile_commands.json \
+#           --db bench.db [--name NAME] [--jobs N] [--cpus LIST] \
+#           [--repeat N] [--compiler CC [--compiler CC ...]]
+#
+# A summary of the runs is printed at the end.  The compilations' outputs are
+# overwritten in place, as a build would, so replay a scratch build tree.
+
+from ..enforce import enforce
+
+import datetime
+import json
+import os
+import shlex
+import shutil
+import statistics
+import sys
+
+# Environment variables that would make replay record less than every
+# compilation, or record them in the background (see 'policy.py' and
+# 'deferred.py').
+_unwantedEnvKeys = ('COMPILATION_METRICS_RECORD_ONE_IN',
+                    'COMPILATION_METRICS_RECORD_SECONDS',
+                    'COMPILATION_METRICS_RECORD_MAXRSS_MIB',
+                    'COMPILATION_METRICS_DETAIL_SECONDS',
+                    'COMPILATION_METRICS_DEFER')
+
+
+# Return a list of (directory, arguments) read from the specified
+# compilation database 'file'.
+#
+def readCompileCommands(file):
+    entries = []
+    for entry in json.load(file):
+        if 'arguments' in entry:
+            arguments = list(entry['arguments'])
+        else:
+            arguments = shlex.split(entry['command'])
+        entries.append((entry['directory'], arguments))
+    return entries
+
+
+# Return the CPUs named by the specified 'cpuList', e.g. "0-3,8".
+#
+def parseCpuList(cpuList):
+    cpus = set()
+    for part in cpuList.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _initializeWorker():
+    for key in _unwantedEnvKeys:
+        os.environ.pop(key, None)
+
+
+# Compile the specified 'arguments' in the specified 'directory', and return
+# (exit status, request), where request is what 'collect.collect' would have
+# recorded, or None if it recorded nothing.
+#
+def _replayOne(task):
+    from . import collect
+
+    directory, arguments = task
+    requests = []
+    os.chdir(directory)
+    rc = collect.collect(arguments, callback=requests.append)
+    return rc, requests[0] if requests else None
+
+
+# Return the arguments of the specified compilation 'entries', each a tuple
+# (directory, arguments), with each compiler replaced by the specified
+# 'compiler', or by its own full path if 'compiler' is None.  The measuring
+# helper (see 'measure.py') doesn't search the PATH.
+#
+def _withCompiler(entries, compiler):
+    tasks = []
+    for directory, arguments in entries:
+        replacement = shutil.which(compiler or arguments[0]) or arguments[0]
+        tasks.append((directory, [replacement] + arguments[1:]))
+    return tasks
+
+
+# Run every compilation in the specified 'entries' once with the specified
+# 'compiler' in the specified 'pool' of processes, and add each to 'db' as
+# part of a build having the specified 'identifier', run on the specified
+# number of 'jobs' at once.  Return (failures, requests).
+#
+def _replayPass(db, pool, entries, compiler, identifier, jobs):
+    from . import collect
+    from ..database import builds
+
+    build = {
+        'identifier': identifier,
+        'tool': 'replay',
+        'startDatetime': datetime.datetime.utcnow().isoformat(),
+        'cores': jobs
+    }
+    failures = 0
+    requests = []
+    for rc, request in pool.imap_unordered(_replayOne,
+                                           _withCompiler(entries, compiler)):
+        if rc != 0:
+            failures += 1
+        if request is None:
+            continue
+        request['build'] = build
+        request['wrapperOverhead'] = None  # It's a worker, not a wrapper.
+        collect.addToDatabase(db, request)
+        requests.append(request)
+    db.commit()
+
+    buildKey, = db.execute('select Key from Build where Identifier = ?;',
+                           (identifier, )).fetchone() or (None, )
+    if buildKey is not None:
+        builds.analyze(db, buildKey)
+        db.commit()
+    return failures, requests
+
+
+# Return a summary of the specified 'runs', which is a list of
+# (compiler, requests), as a list of rows
+#
+#     (compiler, sourceCount, totalSeconds, medianVariationPercent)
+#
+# where totalSeconds is the sum over source files of each file's median
+# duration, and medianVariationPercent is the median over source files of
+# each file's coefficient of variation.
+#
+def summarize(runs):
+    durations = {}  # {compiler: {source path: [seconds]}}
+    for compiler, requests in runs:
+        perSource = durations.setdefault(compiler, {})
+        for request in requests:
+            path = request['sourceInfo']['path']
+            perSource.setdefault(path, []).append(request['durationSeconds'])
+
+    rows = []
+    for compiler, perSource in durations.items():
+        total = sum(statistics.median(seconds)
+                    for seconds in perSource.values())
+        variations = [
+            100 * statistics.stdev(seconds) / statistics.mean(seconds)
+            for seconds in perSource.values()
+            if len(seconds) > 1 and statistics.mean(seconds) > 0
+        ]
+        rows.append((compiler, len(perSource), total,
+                     statistics.median(variations) if variations else None))
+    return rows
+
+
+def replay(entries, db, name, jobs, repeat, compilers, out=sys.stdout):
+    import multiprocessing
+
+    runs = []
+    failures = 0
+    with multiprocessing.Pool(jobs, _initializeWorker) as pool:
+        for repetition in range(repeat):
+            # Alternate the order of the compilers (ABBA...), so that neither
+            # always runs first, e.g. with a cold cache.
+            order = compilers if repetition % 2 == 0 else compilers[::-1]
+            for compiler in order:
+                label = compiler or 'default'
+                identifier = '{}/{}/{}'.format(name, label, repetition)
+                print('replaying', identifier, file=out, flush=True)
+                failed, requests = _replayPass(db, pool, entries, compiler,
+                                               identifier, jobs)
+                failures += failed
+                runs.append((label, requests))
+
+    print('{:<40} {:>8} {:>14} {:>12}'.format('compiler', 'sources',
+                                               'total seconds', 'variation'),
+          file=out)
+    rows = summarize(runs)
+    baseline = rows[0][2] if rows else None
+    for compiler, count, total, variation in rows:
+        print('{:<40} {:>8} {:>14.3f} {:>11}{}'.format(
+            compiler, count, total,
+            '-' if variation is None else '{:.1f}%'.format(variation),
+            '  ({:.3f}x)'.format(total / baseline) if baseline else ''),
+              file=out)
+    if failures:
+        print(failures, 'compilations failed', file=out)
+    return failures
+
+
+if __name__ == '__main__':
+    from ..database.open import connect
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Replay a compilation database and record metrics.')
+    parser.add_argument('compileCommands',
+                        metavar='compile_commands.json',
+                        type=argparse.FileType('r'))
+    parser.add_argument('--db',
+                        required=True,
+                        help='database to record the replay in')
+    parser.add_argument('--name',
+                        default='replay-' +
+                        datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+                        help='name of this benchmark (default: by time)')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='compilations to run at once')
+    parser.add_argument('--cpus',
+                        metavar='LIST',
+                        help='CPUs to run on, e.g. "0-3,8"')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=1,
+                        help='times to run each compilation')
+    parser.add_argument('--compiler',
+                        action='append',
+                        help='compiler to use instead of the listed one '
+                        '(repeat to compare compilers)')
+    options = parser.parse_args()
+
+    productionDb = os.environ.get('COMPILATION_METRICS_DB')
+    enforce(
+        not productionDb or not os.path.exists(options.db)
+        or not os.path.samefile(productionDb, options.db),
+        'Refusing to record a replay in $COMPILATION_METRICS_DB.')
+    enforce(options.jobs > 0 and options.repeat > 0,
+            '--jobs and --repeat must be positive.')
+
+    if options.cpus:
+        os.sched_setaffinity(0, parseCpuList(options.cpus))
+
+    entries = readCompileCommands(options.compileCommands)
+    failures = replay(entries, connect(options.db), options.name,
+                      options.jobs, options.repeat, options.compiler
+                      or [None])
+    sys.exit(1 if failures else 0)
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,201 @@
+# Sample the memory and CPU time used by a process and its descendants over
+# the course of a compilation.
+#
+# The final resource usage of a compilation (see 'measure.py') says how much
+# memory it needed at its peak, but not when, nor for how long.  When
+# $COMPILATION_METRICS_SAMPLE_MS is set to a positive number of milliseconds,
+# a thread polls /proc at that interval for the whole tree of processes
+# started by the compiler (the driver, "cc1plus", "as", etc.), and records a
+# series of samples, each a list
+#
+#     [milliseconds, residentKibibytes, cpuMilliseconds]
+#
+# where 'milliseconds' is the time since the compilation started,
+# 'residentKibibytes' is the sum of the resident set sizes of the processes
+# alive at the time, and 'cpuMilliseconds' is the CPU time (user and system)
+# used so far by the tree, including processes that have since exited.
+# Since /proc counts CPU time in clock ticks (usually 10 milliseconds), so
+# does 'cpuMilliseconds'.
+#
+# The database stores the series delta encoded (see 'database/tables.py').
+#
+# The same polling can also tally the resources used by each program in the
+# tree (see 'subprocesses.py').
+
+import os
+import time
+
+_intervalEnvKey = 'COMPILATION_METRICS_SAMPLE_MS'
+
+# The interval used when only tallying subprocesses.  CPU time in /proc is
+# counted in ticks of (usually) 10 milliseconds, so polling more often gains
+# little.
+defaultInterval = 0.01
+
+
+# Return the sampling interval in seconds, or None if sampling is disabled.
+#
+def interval():
+    try:
+        milliseconds = float(os.environ.get(_intervalEnvKey, '0'))
+    except ValueError:
+        return None
+    return milliseconds / 1000 if milliseconds > 0 else None
+
+
+# Return (name, ppid, utime, stime, cutime, cstime, rssPages) from
+# /proc/PID/stat, where the times are in clock ticks.
+#
+def readStat(pid):
+    # The second field, the command name, is in parentheses and may contain
+    # spaces, so split what comes after it.  The first field after it is the
+    # third field of the file (see proc(5)).
+    with open('/proc/{}/stat'.format(pid), 'rb') as file:
+        data = file.read()
+    nameEnd = data.rindex(b')')
+    name = data[data.index(b'(') + 1:nameEnd].decode('utf8', 'replace')
+    fields = data[nameEnd + 2:].split()
+    utime, stime, cutime, cstime = (int(field) for field in fields[11:15])
+    return name, int(fields[1]), utime, stime, cutime, cstime, int(fields[21])
+
+
+def _childrenFromTasks(pid):
+    children = []
+    for task in os.listdir('/proc/{}/task'.format(pid)):
+        path = '/proc/{}/task/{}/children'.format(pid, task)
+        with open(path, 'rb') as file:
+            children.extend(int(child) for child in file.read().split())
+    return children
+
+
+def _hasChildrenFiles():
+    return os.path.exists('/proc/self/task/{}/children'.format(os.getpid()))
+
+
+# Poll the tree of processes rooted at a process, recording the samples
+# described at the top of this file and, if a 'tally' is specified (see
+# 'subprocesses.Tally'), passing it each snapshot of the tree.
+#
+class Sampler(object):
+    def __init__(self, intervalSeconds, tally=None):
+        import threading
+
+        self._interval = intervalSeconds
+        self._ticksPerSecond = os.sysconf('SC_CLK_TCK')
+        self._pageKibibytes = os.sysconf('SC_PAGE_SIZE') // 1024
+        self._useChildrenFiles = _hasChildrenFiles()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._samples = []
+        self._tally = tally
+
+    # Return {pid: stat} for the tree of processes rooted at the specified
+    # 'root', where each 'stat' is as returned by 'readStat'.
+    def _measureTree(self, root):
+        if self._useChildrenFiles:
+            tree = {}
+            pending = [root]
+            while pending:
+                pid = pending.pop()
+                try:
+                    stat = readStat(pid)
+                    pending.extend(_childrenFromTasks(pid))
+                except (OSError, ValueError, IndexError):
+                    continue  # It exited while we were looking.
+                tree[pid] = stat
+            return tree
+
+        # Without /proc/PID/task/TID/children, look at every process.
+        stats = {}
+        for name in os.listdir('/proc'):
+            if name.isdigit():
+                try:
+                    stats[int(name)] = readStat(name)
+                except (OSError, ValueError, IndexError):
+                    pass
+        tree = {}
+        pending = [root]
+        children = {}
+        for pid, stat in stats.items():
+            children.setdefault(stat[1], []).append(pid)
+        while pending:
+            pid = pending.pop()
+            if pid in stats:
+                tree[pid] = stats[pid]
+                pending.extend(children.get(pid, ()))
+        return tree
+
+    def _run(self, pid, start):
+        while True:
+            tree = self._measureTree(pid)
+            if self._tally is not None:
+                self._tally.update(tree)
+            if not tree:
+                return
+
+            # A process's CPU time includes that of its children that it has
+            # waited for, so the sum over the tree covers processes that have
+            # since exited, too.
+            ticks = sum(sum(stat[2:6]) for stat in tree.values())
+            rssPages = sum(stat[6] for stat in tree.values())
+            self._samples.append([
+                round((time.monotonic() - start) * 1000),
+                rssPages * self._pageKibibytes,
+                round(ticks * 1000 / self._ticksPerSecond)
+            ])
+
+            if self._stopping.wait(self._interval):
+                return
+
+    # Begin sampling the tree of processes rooted at the specified 'pid'.
+    def start(self, pid):
+        import threading
+
+        self._thread = threading.Thread(target=self._run,
+                                        args=(pid, time.monotonic()),
+                                        daemon=True)
+        self._thread.start()
+
+    # Stop sampling, and return the samples described at the top of this
+    # file.
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._samples
+
+
+if __name__ == '__main__':
+    import json
+    import subprocess
+    import sys
+
+    # Sample a command every $COMPILATION_METRICS_SAMPLE_MS milliseconds (or
+    # every 100 milliseconds), and print the samples.
+    sampler = Sampler(interval() or 0.1)
+    child = subprocess.Popen(sys.argv[1:])
+    sampler.start(child.pid)
+    child.wait()
+    for sample in sampler.stop():
+        print(json.dumps(sample))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,208 @@
+# Record compilations by appending them to a spool file, and later ingest the
+# spool into the database in one transaction.
+#
+# When $COMPILATION_METRICS_SPOOL names a directory, each compiler wrapper
+# appends its record, as one line of JSON, to a per-host spool file in that
+# directory (see 'append') and is done.  Nothing talks to the database until
+# 'ingest' is run, e.g. once at the end of a build:
+#
+#     $ python3 -m compilationmetrics.collecting.spool ingest /path/to/spool
+#
+# Each spooled record carries a unique key that becomes its Compilation.Uuid,
+# so ingesting the same records twice (say, after an ingest crashed before it
+# could remove the spool) adds them only once.
+#
+# Appending and rotating the spool are coordinated with 'flock'.  Writers hold
+# a shared lock while they append, and then check that the file they locked
+# is still the one at the spool path.  'ingest' renames the spool out of the
+# way and then takes an exclusive lock on it, so that by the time it reads the
+# renamed file, any writer still holding the old file has finished.
+
+from ..database.open import connect
+from ..database.tables import analyzeIfDue
+from ..database.write import addEntries
+
+import fcntl
+import glob
+import itertools
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+
+_spoolEnvKey = 'COMPILATION_METRICS_SPOOL'
+_spoolSuffix = '.spool'
+_ingestingSuffix = '.ingesting'
+
+
+def spoolDirectory():
+    return os.environ.get(_spoolEnvKey)
+
+
+def _spoolPath(directory):
+    return os.path.join(directory, socket.gethostname() + _spoolSuffix)
+
+
+def _isSameFile(fd, path):
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def _writeAll(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+# Append 'request' to the spool in the specified 'directory' (by default, the
+# value of $COMPILATION_METRICS_SPOOL).  Return whether the request was
+# spooled, i.e. whether there is a spool directory.
+#
+def append(request, directory=None):
+    directory = directory or spoolDirectory()
+    if not directory:
+        return False
+
+    line = json.dumps(dict(request, key=uuid.uuid4().hex)) + '\n'
+    data = line.encode('utf8')
+    path = _spoolPath(directory)
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if _isSameFile(fd, path):
+                _writeAll(fd, data)
+                return True
+            # Otherwise, 'ingest' rotated the file out from under us.  Try
+            # again with the new one.
+        finally:
+            os.close(fd)
+
+
+# Rename each spool file in 'directory' out of the way of writers, and return
+# the paths of all segments awaiting ingestion, including any left over from
+# an earlier ingest that didn't finish.
+#
+def _rotate(directory):
+    for path in glob.glob(os.path.join(directory, '*' + _spoolSuffix)):
+        segment = '{}.{}.{}{}'.format(path, os.getpid(), int(time.time()),
+                                      _ingestingSuffix)
+        try:
+            os.rename(path, segment)
+        except FileNotFoundError:
+            continue  # Somebody else rotated it first.
+
+        # Wait for writers that opened the file before we renamed it.
+        with open(segment, 'rb') as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+    return sorted(glob.glob(os.path.join(directory, '*' + _ingestingSuffix)))
+
+
+def _readRecords(segments, onBadLine):
+    for segment in segments:
+        with open(segment, 'rb') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    onBadLine(segment, line)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Add every record spooled in 'directory' to the database at 'dbPath' (by
+# default, the value of $COMPILATION_METRICS_DB) in a single transaction, and
+# then remove the ingested spool segments.  'toEntry(request)' converts a
+# spooled record into arguments for 'write.addEntries' (see
+# 'collect.toEntry').  Return a dict of counts describing what happened.
+#
+def ingest(directory, toEntry, dbPath=None, chunkSize=1000):
+    counts = {'segments': 0, 'records': 0, 'added': 0, 'badLines': 0}
+
+    def onBadLine(segment, line):
+        counts['badLines'] += 1
+        print('Skipping malformed line in {}: {!r}'.format(segment, line[:80]),
+              file=sys.stderr)
+
+    # Only one ingest at a time.
+    with open(os.path.join(directory, '.ingest.lock'), 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+        segments = _rotate(directory)
+        counts['segments'] = len(segments)
+        if not segments:
+            return counts
+
+        db = connect(dbPath)
+        try:
+            records = _readRecords(segments, onBadLine)
+            for chunk in _chunks(records, chunkSize):
+                counts['records'] += len(chunk)
+                counts['added'] += addEntries(db, map(toEntry, chunk))
+            db.commit()
+            analyzeIfDue(db)
+        finally:
+            db.close()
+
+        # Only now that the records are committed is it safe to forget them.
+        for segment in segments:
+            os.unlink(segment)
+
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+    from .collect import toEntry
+
+    parser = argparse.ArgumentParser(
+        description='Ingest spooled compilation records into the database.')
+    parser.add_argument('command', choices=['ingest'])
+    parser.add_argument('directory',
+                        nargs='?',
+                        default=spoolDirectory(),
+                        help='spool directory (default: ${})'.format(
+                            _spoolEnvKey))
+    parser.add_argument('--db',
+                        help='path to the database '
+                        '(default: $COMPILATION_METRICS_DB)')
+    options = parser.parse_args()
+
+    if not options.directory:
+        parser.error('No spool directory specified, and the environment '
+                     'variable {} is not set.'.format(_spoolEnvKey))
+
+    print(json.dumps(ingest(options.directory, toEntry, options.db),
+                     indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
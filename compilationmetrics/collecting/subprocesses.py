@@ -0,0 +1,216 @@
+# Tally the CPU time and peak memory of each program run during a
+# compilation.
+#
+# The resource usage of a compilation (see 'measure.py') lumps together the
+# compiler driver and everything that it runs: "cc1plus", "as", "collect2",
+# "ld", etc.  When $COMPILATION_METRICS_SUBPROCESSES is "1", the process tree
+# is polled (see 'sampler.py'), and each process's CPU time and peak resident
+# memory ("VmHWM") are attributed to its executable.  The result is a list
+#
+#     [executable, processCount, userSeconds, systemSeconds, maxResidentBytes]
+#
+# with one entry per executable (e.g. "cc1plus").
+#
+# A process's own CPU time is known for certain only after it has exited, and
+# by then it's gone from /proc.  What remains is its parent's "cutime" and
+# "cstime", which grow by the exited process's total (its own time plus that
+# of the children that it waited for) when the parent waits for it.  So, when
+# processes disappear between two polls, the growth in their nearest
+# surviving ancestor's children's time, less what the disappeared processes
+# had already collected from their own children, is their own time, and is
+# shared among them in proportion to the time that each had used when last
+# seen.  The compiler driver itself is waited for by us, so its share comes
+# from the usage that 'measure.py' reports.
+#
+# Processes that start and exit between two polls are never seen.  Their
+# time is attributed to the processes that disappear along with them, if
+# there are any, or to "(unseen)" otherwise.  Peak memory is as of the last
+# poll at which the process was seen, so for very short-lived processes it's
+# an underestimate.
+#
+# When the command runs under the measuring helper (see 'measure.py'), the
+# root of the tree is the helper, which is left out.
+
+import os
+
+_enabledEnvKey = 'COMPILATION_METRICS_SUBPROCESSES'
+
+_unseen = '(unseen)'
+
+
+def enabled():
+    return os.environ.get(_enabledEnvKey, '0') == '1'
+
+
+def _executable(pid, name):
+    # The name in /proc/PID/stat is truncated to 15 characters (e.g. a cross
+    # compiler's "aarch64-linux-gnu-as"), so prefer the executable's path.
+    try:
+        return os.path.basename(os.readlink('/proc/{}/exe'.format(pid)))
+    except OSError:
+        return name
+
+
+def _highWaterKibibytes(pid):
+    try:
+        with open('/proc/{}/status'.format(pid), 'rb') as file:
+            for line in file:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0  # e.g. a zombie, which has no memory anymore
+
+
+class _Process(object):
+    __slots__ = ('name', 'executable', 'ppid', 'times', 'childTimes',
+                 'highWaterKibibytes')
+
+    def __init__(self):
+        self.name = None
+        self.executable = None
+        self.ppid = None
+        self.times = (0, 0)  # (user, system) ticks
+        self.childTimes = (0, 0)  # (user, system) ticks
+        self.highWaterKibibytes = 0
+
+
+# Follow snapshots of a process tree (see 'sampler.Sampler'), and attribute
+# the resources used by each process to its executable.
+#
+class Tally(object):
+    def __init__(self, skipRoot=False):
+        self._skipRoot = skipRoot
+        self._ticksPerSecond = os.sysconf('SC_CLK_TCK')
+        self._live = {}  # {pid: _Process} as of the previous snapshot
+        self._orphaned = []  # gone, without a surviving ancestor in the tree
+        self._executables = {}  # {executable: [count, user, system, kib]}
+
+    def _add(self, executable, count, times, highWaterKibibytes):
+        tally = self._executables.setdefault(executable, [0, 0, 0, 0])
+        tally[0] += count
+        tally[1] += times[0]
+        tally[2] += times[1]
+        tally[3] = max(tally[3], highWaterKibibytes)
+
+    # Attribute to the specified 'processes', which have disappeared, the
+    # specified 'childTimes' (user, system) that their nearest surviving
+    # ancestor collected from them.
+    def _attribute(self, processes, childTimes):
+        shares = [[0, 0] for _ in processes]
+        for i, grown in enumerate(childTimes):
+            remaining = grown - sum(p.childTimes[i] for p in processes)
+            known = [p.times[i] for p in processes]
+            extra = remaining - sum(known)
+            if extra <= 0:
+                extra = 0  # e.g. reparented, so not collected by the ancestor
+            weights = known if sum(known) > 0 else [1] * len(processes)
+            for share, time, weight in zip(shares, known, weights):
+                share[i] = time + extra * weight / sum(weights)
+
+        for process, share in zip(processes, shares):
+            self._add(process.executable, 1, share,
+                      process.highWaterKibibytes)
+
+    # Account for the specified 'tree', which is {pid: stat} as returned by
+    # 'sampler.Sampler._measureTree'.
+    def update(self, tree):
+        gone = {}  # {nearest surviving ancestor: [_Process]}
+        for pid, process in self._live.items():
+            if pid in tree:
+                continue
+            ancestor = process.ppid
+            while ancestor in self._live and ancestor not in tree:
+                ancestor = self._live[ancestor].ppid
+            if ancestor in self._live:
+                gone.setdefault(ancestor, []).append(process)
+            else:
+                self._orphaned.append(process)
+
+        for pid, process in self._live.items():
+            if pid not in tree:
+                continue
+            _, _, _, _, cutime, cstime, _ = tree[pid]
+            grown = (cutime - process.childTimes[0],
+                     cstime - process.childTimes[1])
+            if pid in gone:
+                self._attribute(gone[pid], grown)
+            elif grown[0] > 0 or grown[1] > 0:
+                self._add(_unseen, 0, grown, 0)
+
+        live = {}
+        for pid, stat in tree.items():
+            name, ppid, utime, stime, cutime, cstime, _ = stat
+            if self._skipRoot and ppid == os.getpid():
+                continue  # Its children will be orphaned as far as we know.
+            process = self._live.get(pid) or _Process()
+            if process.name != name:
+                # It's new, or it has exec'd another program.
+                process.name = name
+                process.executable = _executable(pid, name)
+            process.ppid = ppid
+            process.times = utime, stime
+            process.childTimes = cutime, cstime
+            process.highWaterKibibytes = max(process.highWaterKibibytes,
+                                             _highWaterKibibytes(pid))
+            live[pid] = process
+        self._live = live
+
+    # Attribute the remaining processes using the specified resources used
+    # by the root of the tree and its descendants, as reported when the root
+    # was waited for.  Return the list described at the top of this file.
+    def finish(self, userSeconds, systemSeconds):
+        processes = self._orphaned + list(self._live.values())
+        if processes:
+            self._attribute(processes, (userSeconds * self._ticksPerSecond,
+                                        systemSeconds * self._ticksPerSecond))
+        self._orphaned = []
+        self._live = {}
+
+        return [[
+            executable, count, user / self._ticksPerSecond,
+            system / self._ticksPerSecond, kibibytes * 1024
+        ] for executable, (count, user, system, kibibytes) in sorted(
+            self._executables.items())]
+
+
+if __name__ == '__main__':
+    from . import sampler
+    import json
+    import resource
+    import subprocess
+    import sys
+
+    # Run a command and print the resources used by each of its programs.
+    tally = Tally()
+    treeSampler = sampler.Sampler(sampler.interval() or
+                                  sampler.defaultInterval, tally)
+    child = subprocess.Popen(sys.argv[1:])
+    treeSampler.start(child.pid)
+    child.wait()
+    treeSampler.stop()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    rows = tally.finish(usage.ru_utime, usage.ru_stime)
+    print(json.dumps(rows, indent=4))
+    print('total', usage.ru_utime, usage.ru_stime)
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,104 @@
+# Parse the table of per-pass timings that GCC writes to standard error when
+# given "-ftime-report".
+#
+# Recent versions of GCC write
+#
+#     Time variable                                   usr           sys          wall           GGC
+#      phase setup                        :   0.00 (  0%)   0.00 (  0%)   0.00 (  0%)  1326k ( 66%)
+#      phase parsing                      :   0.00 (  0%)   0.01 ( 50%)   0.02 ( 67%)   610k ( 30%)
+#      ...
+#      TOTAL                              :   0.00          0.02          0.03         2011k
+#
+# while older versions (before 9) write
+#
+#     Execution times (seconds)
+#      phase setup             :   0.00 ( 0%) usr   0.00 ( 0%) sys   0.01 ( 6%) wall    1179 kB (14%) ggc
+#      ...
+#
+# and leave out columns that are zero.  Each row becomes a list
+#
+#     [pass, userSeconds, systemSeconds, wallSeconds, ggcBytes]
+#
+# where a column missing from the row is None.  The TOTAL row is left out,
+# since it's the sum of the others.  If the compiler ran more than once (as
+# the driver may, e.g. for LTO), the rows for the same pass are added up.
+
+import re
+
+_row = re.compile(r'^ (\S.*?)\s*:((?:\s*[0-9.]+\s*[kMG]?B?\s*\(\s*[0-9.]+%\)'
+                  r'(?:\s*(?:usr|sys|wall|ggc)\b)?)+)\s*$')
+
+_column = re.compile(r'([0-9.]+)\s*([kMG]?)B?\s*\(\s*[0-9.]+%\)'
+                     r'(?:\s*(usr|sys|wall|ggc)\b)?')
+
+_columnOrder = ('usr', 'sys', 'wall', 'ggc')
+
+_unitBytes = {'': 1, 'k': 1024, 'M': 1024**2, 'G': 1024**3}
+
+
+def _parseColumns(text):
+    columns = {}
+    for position, match in enumerate(_column.finditer(text)):
+        number, unit, label = match.groups()
+        if label is None:
+            if position >= len(_columnOrder):
+                break
+            label = _columnOrder[position]
+        if label == 'ggc':
+            # Old versions say "kB" and new ones "k", but both mean KiB.
+            columns[label] = int(float(number) * _unitBytes[unit])
+        else:
+            columns[label] = float(number)
+    return columns
+
+
+# Return the list of passes described at the top of this file found in the
+# specified 'text' (standard error of the compiler, decoded).
+#
+def parseTimeReport(text):
+    passes = {}
+    for line in text.splitlines():
+        match = _row.match(line)
+        if match is None:
+            continue
+        name, columns = match.group(1), _parseColumns(match.group(2))
+        values = [columns.get(label) for label in _columnOrder]
+
+        previous = passes.get(name)
+        if previous is not None:
+            values = [
+                None if a is None and b is None else (a or 0) + (b or 0)
+                for a, b in zip(previous, values)
+            ]
+        passes[name] = values
+
+    return [[name] + values for name, values in passes.items()]
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    # e.g. gcc -ftime-report -c foo.c 2>&1 | python3 -m ...timereport
+    print(json.dumps(parseTimeReport(sys.stdin.read()), indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,196 @@
+# Summarize the trace that clang writes when a compilation is given
+# "-ftime-trace".
+#
+# The trace is a JSON object in the Chrome tracing format, whose
+# "traceEvents" array holds one event per timed activity: parsing a class,
+# instantiating a function template, optimizing a function, etc.  Traces of
+# large translation units are tens of megabytes, so rather than loading the
+# whole document, the events are decoded one at a time as the file is read
+# (see 'events').
+#
+# The summary (see 'summarize') is a dict
+#
+#     {
+#         'phases': [[phase, seconds, count], ...],
+#         'details': [[phase, detail, seconds, count], ...]
+#     }
+#
+# where 'phases' has the total time spent in each kind of activity (e.g.
+# "Frontend", "Backend", "InstantiateFunction"), and 'details' has, for each
+# kind of activity, the subjects on which the most time was spent (e.g. the
+# most expensive template instantiations), at most 'top' per kind.  For the
+# "Source" phase the details are the included files; note that the time
+# spent in a file includes the time spent in the files that it includes.
+#
+# The number of details kept per phase is $COMPILATION_METRICS_TIME_TRACE_TOP,
+# or 25 by default.
+
+import codecs
+import datetime
+import json
+import os
+import re
+
+_topEnvKey = 'COMPILATION_METRICS_TIME_TRACE_TOP'
+
+_chunkSize = 1024 * 1024
+
+_eventsStart = re.compile(r'"traceEvents"\s*:\s*\[')
+_separator = re.compile(r'[\s,]*')
+
+
+def _top():
+    try:
+        return max(0, int(os.environ.get(_topEnvKey, '25')))
+    except ValueError:
+        return 25
+
+
+# Yield each event in the "traceEvents" array of the JSON trace read from the
+# specified binary 'file', without reading the whole file into memory.
+#
+def events(file, chunkSize=_chunkSize):
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder('utf8')()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunkSize)
+        eof = not chunk
+        buffer = buffer[position:] + textDecoder.decode(chunk, final=eof)
+        position = 0
+
+    while True:
+        match = _eventsStart.search(buffer, position)
+        if match:
+            position = match.end()
+            break
+        if eof:
+            return  # no events
+        # Keep enough of the end of the buffer to find a split marker.
+        position = max(position, len(buffer) - 64)
+        fill()
+
+    while True:
+        position = _separator.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise ValueError('The trace ends in the middle of its events.')
+            fill()
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            event, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            fill()  # Probably the event continues in the next chunk.
+            continue
+        yield event
+
+
+# Return the summary described at the top of this file of the specified
+# trace 'events', keeping at most 'top' details per phase.
+#
+def summarize(events, top):
+    totals = {}  # {phase: [seconds, count]}, as reported by clang
+    sums = {}  # {phase: [seconds, count]}, as added up here
+    details = {}  # {(phase, detail): [seconds, count]}
+
+    for event in events:
+        if event.get('ph') != 'X':
+            continue  # not a complete (timed) event
+        name = event.get('name', '')
+        seconds = event.get('dur', 0) / 1000000
+        args = event.get('args') or {}
+
+        if name.startswith('Total '):
+            # Clang adds up each kind of event for us, without counting
+            # recursive events (e.g. nested instantiations) twice.
+            totals[name[len('Total '):]] = [seconds, args.get('count', 0)]
+            continue
+
+        tally = sums.setdefault(name, [0, 0])
+        tally[0] += seconds
+        tally[1] += 1
+
+        detail = args.get('detail')
+        if detail is not None:
+            tally = details.setdefault((name, detail), [0, 0])
+            tally[0] += seconds
+            tally[1] += 1
+
+    phases = totals or sums
+
+    byPhase = {}
+    for (phase, detail), (seconds, count) in details.items():
+        byPhase.setdefault(phase, []).append([phase, detail, seconds, count])
+    kept = []
+    for rows in byPhase.values():
+        rows.sort(key=lambda row: row[2], reverse=True)
+        kept.extend(rows[:top])
+
+    return {
+        'phases': [[phase, seconds, count]
+                   for phase, (seconds, count) in phases.items()],
+        'details': kept
+    }
+
+
+# Return the summary of the time trace written by the compilation that ran
+# the specified 'cmd' and started at the specified 'start' (a UTC datetime),
+# or None if the command didn't ask for a trace, or there isn't a readable
+# one newer than 'start'.  The trace is optional, so a trace that's missing,
+# truncated, or malformed doesn't cost the compilation its record.
+#
+def readTimeTrace(cmd, start):
+    path = cmd.timeTracePath()
+    if path is None:
+        return None
+
+    try:
+        with open(path, 'rb') as file:
+            # Ignore a trace left over from an earlier compilation.  Allow
+            # for file systems with coarse timestamps.
+            started = start.replace(tzinfo=datetime.timezone.utc).timestamp()
+            if os.fstat(file.fileno()).st_mtime < started - 2:
+                return None
+            return summarize(events(file), _top())
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit('usage: {} TRACE.json'.format(sys.argv[0]))
+
+    with open(sys.argv[1], 'rb') as file:
+        print(json.dumps(summarize(events(file), _top()), indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
@@ -0,0 +1,238 @@
+# Reconstruct the timeline of each build (see 'collecting/build.py') from
+# its compilations, and store statistics about it in the Build table.
+#
+# The statistics say why a build took as long as it did, as opposed to which
+# file took longest to compile:
+#
+# - AverageParallelism is the compile time divided by the wall time, from
+#   the start of the first compilation to the end of the last.  Compared
+#   with Cores (and -j), it says how well the build kept the machine busy.
+# - PeakParallelism is the most compilations that ran at once.
+# - IdleCoreSeconds is how much CPU time was left unused by compilations.
+#   Linking, code generation, and other non-compile steps show up here.  It's
+#   zero if the build ran more compilations at once than it had cores.
+# - SerialSeconds is the time during which at most one compilation was
+#   running, e.g. while the build waited on a slow file or a link.
+# - LongestChain is the heaviest sequence of compilations, each of which
+#   started after the previous one ended.  Nothing about the timeline says
+#   that they depended on one another, but when the chain is a large part of
+#   the wall time, the build was bound by it rather than by cores, and the
+#   files in it are the ones to look at first.
+#
+# Usage:
+#
+#     $ python3 -m compilationmetrics.database.builds [--db PATH] [--all]
+#     $ python3 -m compilationmetrics.database.builds --timeline IDENTIFIER
+#
+# By default only builds without statistics are analyzed, and the statistics
+# of each are printed as JSON.  A build still in progress should be analyzed
+# again (--all) once it's finished.
+
+import bisect
+import datetime
+
+
+def _seconds(iso8601):
+    # Compilation start times are in UTC, without saying so.
+    return datetime.datetime.fromisoformat(iso8601).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+# Return the heaviest chain of non-overlapping 'intervals', each a tuple
+# (start, end, key), as a list of indices into 'intervals'.  This is the
+# classic weighted interval scheduling problem, with each interval weighted
+# by its length.
+#
+def _longestChain(intervals):
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i][1])
+    ends = [intervals[i][1] for i in order]
+    best = [0.0]  # best[k]: weight of the best chain among order[:k]
+    taken = [False]
+    previous = [0]
+    for k, i in enumerate(order):
+        start, end, _ = intervals[i]
+        # The intervals that end no later than this one starts.
+        p = bisect.bisect_right(ends, start, 0, k)
+        withThis = best[p] + (end - start)
+        if withThis > best[k]:
+            best.append(withThis)
+            taken.append(True)
+        else:
+            best.append(best[k])
+            taken.append(False)
+        previous.append(p)
+
+    chain = []
+    k = len(order)
+    while k > 0:
+        if taken[k]:
+            chain.append(order[k - 1])
+            k = previous[k]
+        else:
+            k -= 1
+    chain.reverse()
+    return chain
+
+
+# Return a dict of statistics (see the top of this file) describing the
+# specified 'intervals', each a tuple (startSeconds, endSeconds, key), run on
+# the specified number of 'cores' (or None if not known).  The dict's
+# 'chain' is the list of keys in the longest chain.
+#
+def timeline(intervals, cores=None):
+    if not intervals:
+        return None
+
+    first = min(start for start, _, _ in intervals)
+    last = max(end for _, end, _ in intervals)
+    wall = last - first
+    busy = sum(end - start for start, end, _ in intervals)
+
+    # Sweep through the starts and ends.  At equal times, ends come first, so
+    # that back-to-back compilations don't count as overlapping.
+    events = sorted([(start, 1) for start, _, _ in intervals] +
+                    [(end, -1) for _, end, _ in intervals])
+    running = 0
+    peak = 0
+    serial = 0.0
+    previousTime = first
+    for time, change in events:
+        if running <= 1:
+            serial += time - previousTime
+        running += change
+        peak = max(peak, running)
+        previousTime = time
+
+    chain = _longestChain(intervals)
+
+    return {
+        'compilationCount': len(intervals),
+        'wallSeconds': wall,
+        'compileSeconds': busy,
+        'averageParallelism': busy / wall if wall > 0 else None,
+        'peakParallelism': peak,
+        'idleCoreSeconds': max(0, cores * wall - busy) if cores else None,
+        'serialSeconds': serial,
+        'longestChainSeconds': sum(intervals[i][1] - intervals[i][0]
+                                   for i in chain),
+        'longestChainCount': len(chain),
+        'chain': [intervals[i][2] for i in chain]
+    }
+
+
+def _intervals(db, buildKey):
+    return [(_seconds(start), _seconds(start) + duration, key)
+            for key, start, duration in db.execute(
+                'select Key, StartIso8601, DurationSeconds '
+                'from Compilation where BuildKey = ?;', (buildKey, ))]
+
+
+def _iso8601(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat()
+
+
+# Calculate the statistics of the build having the specified 'buildKey',
+# store them in its row of the Build table without committing, and return
+# them (or None if the build has no compilations).
+#
+def analyze(db, buildKey):
+    cores, = db.execute('select Cores from Build where Key = ?;',
+                        (buildKey, )).fetchone()
+    intervals = _intervals(db, buildKey)
+    stats = timeline(intervals, cores)
+    if stats is None:
+        return None
+
+    first = min(start for start, _, _ in intervals)
+    last = max(end for _, end, _ in intervals)
+    db.execute(
+        '''update Build
+           set CompilationCount = ?, FirstStartIso8601 = ?,
+               LastEndIso8601 = ?, WallSeconds = ?, CompileSeconds = ?,
+               AverageParallelism = ?, PeakParallelism = ?,
+               IdleCoreSeconds = ?, SerialSeconds = ?,
+               LongestChainSeconds = ?, LongestChainCount = ?
+           where Key = ?;''',
+        (stats['compilationCount'], _iso8601(first), _iso8601(last),
+         stats['wallSeconds'], stats['compileSeconds'],
+         stats['averageParallelism'], stats['peakParallelism'],
+         stats['idleCoreSeconds'], stats['serialSeconds'],
+         stats['longestChainSeconds'], stats['longestChainCount'], buildKey))
+    return stats
+
+
+# Analyze every build, or only those not analyzed yet, and commit.  Return
+# {identifier: statistics}.
+#
+def analyzeAll(db, onlyNew=True):
+    query = 'select Key, Identifier from Build'
+    if onlyNew:
+        query += ' where CompilationCount is null'
+    results = {}
+    for key, identifier in db.execute(query + ';').fetchall():
+        results[identifier] = analyze(db, key)
+    db.commit()
+    return results
+
+
+# Return the compilations of the build having the specified 'identifier' as
+# rows (offsetSeconds, durationSeconds, fileName), in order of start.
+#
+def timelineRows(db, identifier):
+    rows = db.execute(
+        '''select c.StartIso8601, c.DurationSeconds, f.Name
+           from Compilation c
+           inner join Build b on c.BuildKey = b.Key
+           inner join File f on c.FileKey = f.Key
+           where b.Identifier = ?
+           order by c.StartIso8601;''', (identifier, )).fetchall()
+    if not rows:
+        return []
+    first = _seconds(rows[0][0])
+    return [(_seconds(start) - first, duration, name)
+            for start, duration, name in rows]
+
+
+if __name__ == '__main__':
+    from .open import connect
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description='Calculate statistics about builds.')
+    parser.add_argument('--db', help='database path (default: from env)')
+    parser.add_argument('--all',
+                        action='store_true',
+                        help='analyze builds that were analyzed before, too')
+    parser.add_argument('--timeline',
+                        metavar='IDENTIFIER',
+                        help="print the build's compilations instead")
+    options = parser.parse_args()
+
+    db = connect(options.db)
+    if options.timeline:
+        for offset, duration, name in timelineRows(db, options.timeline):
+            print('{:10.3f} {:10.3f}  {}'.format(offset, duration, name))
+    else:
+        print(json.dumps(analyzeAll(db, not options.all), indent=4))
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
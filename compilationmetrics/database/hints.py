@@ -0,0 +1,246 @@
+# Estimate what each build target (object file) costs to compile, from its
+# recent compilations, and export the estimates in forms that build tools can
+# use to start the most expensive compilations first.
+#
+# A target is the output path given to the compiler ("-o foo.o"), as recorded
+# in Compilation.OutputArgument.  Build tools usually pass paths relative to
+# the build directory, so these are the same names that the build tool uses.
+# Its estimates are:
+#
+# - seconds: the median DurationSeconds of its most recent compilations, which
+#   one unusually slow or fast compilation (e.g. on a loaded machine) doesn't
+#   throw off;
+# - maxResidentBytes: the 95th percentile of MaxResidentMemoryBytes over the
+#   same compilations.
+#
+# The estimates are exported as either:
+#
+# - a ".ninja_log": ninja (1.12 and later) prioritizes the targets on the
+#   longest path through the build, weighing each by the duration recorded in
+#   its log.  The log's existing entries keep their output modification times
+#   and command hashes, so nothing is rebuilt on their account; only their
+#   durations change.  Targets not in the log are added to it with a zero
+#   hash, which ninja would rebuild anyway, since it has no record of them.
+# - a tab-separated list, most expensive first, of
+#
+#       target  seconds  maxResidentBytes  pool
+#
+#   where pool is "heavy" for targets whose memory estimate is at least the
+#   --heavy-mib threshold and "default" otherwise.  GNU make starts the
+#   prerequisites of a target in the order in which they're listed, so
+#   ordering a list of objects by the first column, e.g.
+#
+#       OBJECTS := $(filter $(OBJECTS),$(shell cut -f 1 hints.tsv)) \
+#                  $(filter-out $(shell cut -f 1 hints.tsv),$(OBJECTS))
+#
+#   starts the longest compilations first.  The pool column can be used to
+#   assign targets to a ninja pool of limited depth, or to a separate make
+#   invocation with a lower -j, so that memory-hungry compilations don't run
+#   the machine out of memory together.
+#
+# Usage:
+#
+#     $ python3 -m compilationmetrics.database.hints [--db PATH] \
+#           [--recent N] [--since DATE] [--path-prefix DIR] \
+#           (--ninja-log PATH | --make PATH) [--heavy-mib MIB]
+
+import collections
+import os
+
+defaultRecent = 5
+defaultHeavyMebibytes = 2048
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def _percentile(values, percent):
+    # nearest rank
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+# Return {compilationKey: target} for the compilations recorded since the
+# specified 'since' date (or all of them if it's None) whose source files
+# are under the specified 'pathPrefix' (or anywhere if it's None).
+#
+def _targets(db, since, pathPrefix):
+    query = '''
+        select c.Key, c.OutputArgument
+        from Compilation c
+        inner join File f on c.FileKey = f.Key
+        where c.OutputArgument is not null'''
+    parameters = []
+    if since is not None:
+        query += ' and c.StartIso8601 >= ?'
+        parameters.append(since)
+    if pathPrefix is not None:
+        query += ' and substr(f.Path, 1, length(?)) = ?'
+        parameters.extend([pathPrefix, pathPrefix])
+
+    return {
+        key: os.path.normpath(target)
+        for key, target in db.execute(query + ';', parameters)
+    }
+
+
+# Return {target: (seconds, maxResidentBytes, count)} estimated from at most
+# the specified number of 'recent' compilations of each target.  See the top
+# of this file.
+#
+def estimates(db, recent=defaultRecent, since=None, pathPrefix=None):
+    targets = _targets(db, since, pathPrefix)
+
+    history = collections.defaultdict(list)
+    for key, start, duration, memory in db.execute(
+            'select Key, StartIso8601, DurationSeconds, '
+            'MaxResidentMemoryBytes from Compilation;'):
+        target = targets.get(key)
+        if target is not None:
+            history[target].append((start, duration, memory))
+
+    result = {}
+    for target, runs in history.items():
+        runs = sorted(runs, reverse=True)[:recent]
+        result[target] = (_median([duration for _, duration, _ in runs]),
+                          _percentile([memory for _, _, memory in runs], 95),
+                          len(runs))
+    return result
+
+
+# Return the specified 'estimates' as rows (target, seconds,
+# maxResidentBytes, pool), most expensive first.
+#
+def makeRows(estimates, heavyMebibytes=defaultHeavyMebibytes):
+    heavyBytes = heavyMebibytes * 1024 * 1024
+    rows = [(target, seconds, memory,
+             'heavy' if memory >= heavyBytes else 'default')
+            for target, (seconds, memory, _) in estimates.items()]
+    rows.sort(key=lambda row: (-row[1], row[0]))
+    return rows
+
+
+def writeMakeList(file, estimates, heavyMebibytes=defaultHeavyMebibytes):
+    for target, seconds, memory, pool in makeRows(estimates, heavyMebibytes):
+        file.write('{}\t{:.3f}\t{}\t{}\n'.format(target, seconds, memory,
+                                                pool))
+
+
+_ninjaLogHeader = '# ninja log v5\n'
+
+
+# Return the lines of the specified '.ninja_log' 'text' with the durations of
+# the targets in the specified 'estimates' replaced by their estimates, and
+# with entries for estimated targets missing from the log appended.
+#
+def ninjaLogLines(text, estimates):
+    lines = text.splitlines(True) if text else [_ninjaLogHeader]
+    result = []
+    seen = set()
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if line.startswith('#') or len(fields) != 5 or \
+                not fields[0].isdigit():
+            result.append(line)
+            continue
+        start, _, mtime, output, commandHash = fields
+        estimate = estimates.get(os.path.normpath(output))
+        if estimate is None:
+            result.append(line)
+            continue
+        seen.add(os.path.normpath(output))
+        end = int(start) + int(estimate[0] * 1000)
+        result.append('\t'.join([start, str(end), mtime, output, commandHash])
+                      + '\n')
+
+    for target in sorted(set(estimates) - seen):
+        milliseconds = int(estimates[target][0] * 1000)
+        result.append('0\t{}\t0\t{}\t0\n'.format(milliseconds, target))
+    return result
+
+
+# Rewrite (or create) the '.ninja_log' at the specified 'path' as described
+# by 'ninjaLogLines'.  The log is replaced atomically, so that a build
+# running at the same time reads either the old log or the new one.
+#
+def writeNinjaLog(path, estimates):
+    try:
+        with open(path) as file:
+            text = file.read()
+    except FileNotFoundError:
+        text = ''
+
+    temporary = path + '.hints'
+    with open(temporary, 'w') as file:
+        file.writelines(ninjaLogLines(text, estimates))
+    os.replace(temporary, path)
+
+
+if __name__ == '__main__':
+    from .open import connect
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Export compile cost estimates for build scheduling.')
+    parser.add_argument('--db', help='database path (default: from env)')
+    parser.add_argument('--recent',
+                        type=int,
+                        default=defaultRecent,
+                        help='compilations per target to estimate from')
+    parser.add_argument('--since',
+                        metavar='DATE',
+                        help='ignore compilations before this ISO 8601 date')
+    parser.add_argument('--path-prefix',
+                        metavar='DIR',
+                        help='only source files under this absolute path')
+    parser.add_argument('--heavy-mib',
+                        type=float,
+                        default=defaultHeavyMebibytes,
+                        help='memory estimate at which a target is "heavy"')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--ninja-log',
+                        metavar='PATH',
+                        help='update the durations in this .ninja_log')
+    output.add_argument('--make',
+                        metavar='PATH',
+                        help='write a tab-separated list ("-" for stdout)')
+    options = parser.parse_args()
+
+    db = connect(options.db)
+    targetEstimates = estimates(db, options.recent, options.since,
+                                options.path_prefix)
+    if options.ninja_log:
+        writeNinjaLog(options.ninja_log, targetEstimates)
+    elif options.make == '-':
+        import sys
+        writeMakeList(sys.stdout, targetEstimates, options.heavy_mib)
+    else:
+        with open(options.make, 'w') as file:
+            writeMakeList(file, targetEstimates, options.heavy_mib)
+'''
+Copyright (c) 2016 David Goffredo
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
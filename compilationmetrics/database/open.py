@@ -7,6 +7,15 @@ from . import tables
 sqlite3.register_adapter(datetime.datetime, datetime.datetime.isoformat)
 
 _dbEnvKey = 'COMPILATION_METRICS_DB'
+_busyTimeoutEnvKey = 'COMPILATION_METRICS_BUSY_TIMEOUT_MS'
+_walEnvKey = 'COMPILATION_METRICS_WAL'
+
+defaultBusyTimeoutMilliseconds = 30000
+
+# How many times 'writeTransaction' tries, and how long it waits before the
+# first retry (doubling for each one after).
+writeAttempts = 6
+firstRetrySeconds = 0.05
 
 
 def _getDbPath(dbPath):
@@ -20,12 +29,87 @@ def _getDbPath(dbPath):
     return dbPath
 
 
+# Return how long to wait for another connection's lock before giving up
+# with "database is locked": $COMPILATION_METRICS_BUSY_TIMEOUT_MS, or
+# 'defaultBusyTimeoutMilliseconds'.
+#
+def busyTimeoutSeconds():
+    try:
+        milliseconds = float(
+            os.environ.get(_busyTimeoutEnvKey,
+                           defaultBusyTimeoutMilliseconds))
+    except ValueError:
+        milliseconds = defaultBusyTimeoutMilliseconds
+    return max(0, milliseconds) / 1000
+
+
+# Write-ahead logging lets reports read while compilations are recorded, and
+# makes each commit an append to the log rather than a rewrite of the
+# database, which with "synchronous = normal" isn't synced until the log is
+# checkpointed.  The journal mode is stored in the database, so it's changed
+# only once, by whichever connection first finds it unchanged; if that fails
+# (say, because another connection is busy), the next connection tries
+# again.  WAL needs shared memory between the writers, so a database on a
+# network file system shared by several hosts must opt out by setting
+# $COMPILATION_METRICS_WAL to "0".
+#
+def _configure(db):
+    if os.environ.get(_walEnvKey, '1') != '0':
+        mode, = db.execute('pragma journal_mode;').fetchone()
+        if mode.lower() != 'wal':
+            try:
+                db.execute('pragma journal_mode = wal;')
+            except sqlite3.OperationalError:
+                pass
+        db.execute('pragma synchronous = normal;')
+    db.execute('pragma foreign_keys = on;')
+
+
 def connect(dbPath=None):
-    db = sqlite3.connect(_getDbPath(dbPath))
+    db = sqlite3.connect(_getDbPath(dbPath), timeout=busyTimeoutSeconds())
+    _configure(db)
     tables.createAll(db)
     return db
 
 
+# Return whether the specified 'error' means that another connection held a
+# lock that was needed, so that trying again later may succeed.
+#
+def isBusy(error):
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+# Call 'work(db)' in a transaction that takes the write lock up front
+# ("begin immediate"), commit, and return what 'work' returned.  Taking the
+# lock first means that a busy database makes the transaction wait (up to the
+# busy timeout) before it has done anything, rather than fail halfway
+# through.  If it still fails because the database is busy, the transaction
+# is rolled back and retried after a random delay (so that the writers that
+# collided don't collide again), up to 'writeAttempts' times in all.  Any
+# other error, or the last one, is raised.
+#
+def writeTransaction(db, work):
+    import random
+    import time
+
+    for attempt in range(writeAttempts):
+        try:
+            db.execute('begin immediate;')
+            result = work(db)
+            db.commit()
+            return result
+        except Exception as error:
+            if db.in_transaction:
+                db.rollback()
+            if attempt + 1 == writeAttempts or not isBusy(error):
+                raise
+            delay = firstRetrySeconds * 2**attempt
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
 '''
 Copyright (c) 2016 David Goffredo
 
@@ -1,8 +1,12 @@
 # Provides a generator 'query' that manages a connection with a sqlite3
 # database file and runs its SQL query argument in an environment having
-# a view (virtual read-only table) for convenience.
+# views (virtual read-only tables) for convenience: CompilationView, and
+# HeaderCostView.  A query that mentions ResourceSample also gets a temporary
+# table of that name, having the resource series (see 'tables.py') of the
+# compilations in CompilationView decoded into rows.
 
 from .open import connect
+from .tables import analyzeIfDue, decodeSeries
 from contextlib import contextmanager
 
 
@@ -56,6 +60,34 @@ select
        /* Computed convenience columns */
      , UserCpuTime + SystemCpuTime                        as CpuTime
      , BlockingInputOperations + BlockingOutputOperations as BlockingOperations
+     , MinorPageFaults + MajorPageFaults                  as PageFaults
+     , VoluntaryContextSwitches + InvoluntaryContextSwitches
+                                                          as ContextSwitches
+     , coalesce(SampleWeight, 1)                          as Weight
+
+       /* Seconds spent in phases of the compilation, according to clang's
+          -ftime-trace (see collecting/timetrace.py), or null without one */
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'Frontend')
+                                                          as FrontendSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'Backend')
+                                                          as BackendSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'Source')
+                                                          as SourceSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'ParseClass')
+                                                          as ParseClassSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'InstantiateClass')
+                                                          as InstantiateClassSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'InstantiateFunction')
+                                                          as InstantiateFunctionSeconds
+     , (select Seconds from TimeTracePhase
+        where CompilationKey = Compilation.Key and Phase = 'OptFunction')
+                                                          as OptFunctionSeconds
 
        /* Some fields from the joined-in tables */
      , File.Name                                          as FileName
@@ -78,6 +110,78 @@ inner join File    on Compilation.FileKey = File.Key
 '''
 
 
+# One row per header included by each compilation in CompilationView (for
+# compilations recorded with include tracing; see
+# 'collecting/includes.py').  The compilation's duration is apportioned
+# among its headers by their share of its preprocessed bytes.  This is only
+# an estimate, since not every byte costs the compiler the same, but it
+# points at the headers worth slimming down.
+_headerViewDescriptionTemplate = '''
+create temporary view {viewName} as
+select
+       Header.Path                                        as HeaderPath
+     , IncludedBy.Path                                    as IncludedByPath
+     , Inclusion.Depth                                    as Depth
+     , Inclusion.IncludeCount                             as IncludeCount
+     , Inclusion.SelfSizeBytes                            as SelfSizeBytes
+     , Inclusion.InclusiveSizeBytes                       as InclusiveSizeBytes
+
+       /* Estimated share of the compilation's duration */
+     , c.DurationSeconds * Inclusion.SelfSizeBytes
+           / c.FilePreprocessedSizeBytes                  as SelfSeconds
+     , c.DurationSeconds * Inclusion.InclusiveSizeBytes
+           / c.FilePreprocessedSizeBytes                  as InclusiveSeconds
+
+       /* Some fields from the compilation */
+     , c.Key                                              as CompilationKey
+     , c.FileName                                         as FileName
+     , c.FilePath                                         as FilePath
+     , c.FilePreprocessedSizeBytes                        as FilePreprocessedSizeBytes
+     , c.Start                                            as Start
+     , c.Duration                                         as Duration
+     , c.System                                           as System
+     , c.User                                             as User
+from Inclusion
+inner join {compilationViewName} c on Inclusion.CompilationKey = c.Key
+inner join Header                  on Inclusion.HeaderKey = Header.Key
+left join  Header IncludedBy       on Inclusion.IncludedByKey = IncludedBy.Key
+where c.FilePreprocessedSizeBytes > 0;
+'''
+
+
+_resourceSampleDescription = '''
+create temporary table ResourceSample(
+    CompilationKey integer not null,
+    Seconds        real not null, /* since the compilation started */
+    RssBytes       integer not null,
+    CpuSeconds     real not null, /* used so far */
+    Cores          real /* CPU seconds per second since the previous sample */
+);'''
+
+
+def _createResourceSampleTable(db, compilationViewName):
+    db.execute(_resourceSampleDescription)
+
+    def rows():
+        for key, encoded in db.execute(
+                'select CompilationKey, Encoded from ResourceSeries '
+                'where CompilationKey in (select Key from {});'.format(
+                    compilationViewName)):
+            previous = None
+            for milliseconds, rssKibibytes, cpuMilliseconds in decodeSeries(
+                    encoded):
+                cores = None
+                if previous is not None and milliseconds > previous[0]:
+                    cores = (cpuMilliseconds - previous[1]) / (milliseconds -
+                                                               previous[0])
+                previous = milliseconds, cpuMilliseconds
+                yield (key, milliseconds / 1000, rssKibibytes * 1024,
+                       cpuMilliseconds / 1000, cores)
+
+    db.executemany('insert into ResourceSample values(?, ?, ?, ?, ?);',
+                   list(rows()))
+
+
 @contextmanager
 def _scopedView(db, plot):
     # Build the query that will define the SQL view.
@@ -99,10 +203,20 @@ def _scopedView(db, plot):
     # Create the view and expose the modified database connection to the
     # caller (who will be using this function in a 'with' statement).
     db.execute(viewDesc)
+    headerViewName = 'HeaderCostView'
+    db.execute(
+        _headerViewDescriptionTemplate.format(viewName=headerViewName,
+                                              compilationViewName=viewName))
+    hasSamples = 'ResourceSample' in plot.query
+    if hasSamples:
+        _createResourceSampleTable(db, viewName)
     db.commit()
     yield db
 
-    # Now the caller is done with this view.
+    # Now the caller is done with these views.
+    if hasSamples:
+        db.execute('drop table ResourceSample;')
+    db.execute('drop view {};'.format(headerViewName))
     db.execute('drop view {};'.format(viewName))
     db.execute('drop table if exists {};'.format(tempTableName))
     db.commit()
@@ -111,6 +225,7 @@ def _scopedView(db, plot):
 @contextmanager
 def _databaseWithView(plot, databaseName):
     db = connect(databaseName)
+    analyzeIfDue(db)
 
     # Add a temporary view to our connection and expose it to the caller.
     with _scopedView(db, plot) as dbWithView:
@@ -1,3 +1,8 @@
+from ..enforce import enforce
+
+import hashlib
+import zlib
+
 fileDef = '''
 create table if not exists
 File(
@@ -5,13 +10,22 @@ File(
     Name        text not null,
     Path        text not null,
     GitRevision text not null, /* empty string if not available */
-    GitDiffHead text not null,
+    GitDiffHash text references Diff(Hash) not null,
     LineCount integer,
     SizeBytes integer,
     PreprocessedSizeBytes integer,
     PreprocessedLineCount integer,
+    IdentityHash text, /* see 'identityHash' */
+
+    unique(Name, Path, GitRevision, GitDiffHash, SizeBytes)
+);'''
 
-    unique(Name, Path, GitRevision, GitDiffHead, SizeBytes)
+diffDef = '''
+create table if not exists
+Diff(
+    Hash       text primary key, /* hex SHA-256 of the uncompressed text */
+    SizeBytes  integer not null, /* of the uncompressed text */
+    Compressed blob not null     /* zlib compressed UTF-8 text */
 );'''
 
 machineDef = '''
@@ -25,15 +39,45 @@ Machine(
     MachineArch text not null,
     Processor   text not null,
     PageSize    integer not null,
+    IdentityHash text, /* see 'identityHash' */
 
     unique(Name, System, Release, Version, MachineArch, Processor,
            PageSize)
 );'''
 
+buildDef = '''
+/* A build (e.g. one run of make) that compilations were part of (see
+   collecting/build.py).  The statistics after Cores describe the build's
+   timeline, and are null until calculated by database/builds.py. */
+create table if not exists
+Build(
+    Key                 integer primary key,
+    Identifier          text unique not null,
+    Tool                text, /* e.g. "make", or null if not known */
+    StartIso8601        text, /* when the build tool started, if known */
+    Cores               integer, /* CPUs available to the compilations */
+
+    CompilationCount    integer,
+    FirstStartIso8601   text, /* when the first compilation started */
+    LastEndIso8601      text, /* when the last compilation ended */
+    WallSeconds         real, /* from the first start to the last end */
+    CompileSeconds      real, /* the sum of the compilations' durations */
+    AverageParallelism  real, /* CompileSeconds / WallSeconds */
+    PeakParallelism     integer, /* most compilations at once */
+    IdleCoreSeconds     real, /* Cores * WallSeconds - CompileSeconds */
+    SerialSeconds       real, /* time with at most one compilation */
+    LongestChainSeconds real, /* see database/builds.py */
+    LongestChainCount   integer
+);'''
+
 compilationDef = '''
 create table if not exists 
 Compilation(
-    Key                      text primary key,
+    Key                      integer primary key,
+    /* A unique identifier for referring to the compilation from outside of
+       the database, e.g. from a spooled record (see collecting/spool.py), or
+       null if there's no need. */
+    Uuid                     text unique,
     User                     text not null,
     StartIso8601             text not null,
     DurationSeconds          real not null,
@@ -45,37 +89,703 @@ Compilation(
     FileKey                  integer references File(Key) not null,
     CompilerPath             text not null,
     OutputObjectSizeBytes    integer not null,
-    MachineKey               integer references Machine(Key) not null
+    MachineKey               integer references Machine(Key) not null,
+    /* The following are null for compilations recorded before they were. */
+    MinorPageFaults            integer,
+    MajorPageFaults            integer,
+    Swaps                      integer,
+    VoluntaryContextSwitches   integer,
+    InvoluntaryContextSwitches integer,
+    /* How many compilations this one stands for, when only some are
+       recorded (see collecting/policy.py).  Null means 1. */
+    SampleWeight               integer,
+    BuildKey                   integer references Build(Key),
+    /* The command line, with the source and output paths factored out
+       (see 'normalizeCommand'), and the paths themselves, as given. */
+    CommandLineKey             integer references CommandLine(Key),
+    SourceArgument             text,
+    OutputArgument             text
+);'''
+
+# Each distinct command line is stored once, with the compilation's source
+# and output paths factored out of it, so that the compilations of a project,
+# which mostly differ only in those, share a command line.
+commandLineDef = '''
+create table if not exists
+CommandLine(
+    Key           integer primary key,
+    Hash          text not null unique, /* see 'commandLineHash' */
+    ArgumentCount integer not null
 );'''
 
+commandArgumentDef = '''
+create table if not exists
+CommandArgument(
+    CommandLineKey integer references CommandLine(Key) not null,
+    Position       integer not null,
+    Value          text not null, /* as encoded by 'normalizeCommand' */
+
+    primary key(CommandLineKey, Position)
+) without rowid;'''
+
+# Each argument of each compilation's command, as the compiler got it.  The
+# replacements undo 'normalizeCommand' using only SQL's own functions, so
+# that the view works in any SQLite client.
+argumentViewDef = '''
+create view if not exists
+Argument(CompilationKey, Position, Value) as
+select c.Key, a.Position,
+       replace(replace(replace(a.Value,
+                               '$S', coalesce(c.SourceArgument, '')),
+                       '$O', coalesce(c.OutputArgument, '')),
+               '$D', '$')
+from Compilation c
+inner join CommandArgument a on a.CommandLineKey = c.CommandLineKey;'''
+
+# Before command lines were interned, the arguments of each compilation were
+# stored in this table, which is now a view (see 'argumentViewDef').
 argumentDef = '''
 create table if not exists
 Argument(
-    CompilationKey text references Compilation(Key) not null,
+    CompilationKey integer references Compilation(Key) not null,
     Position       integer not null,
     Value          text not null,
 
     primary key(CompilationKey, Position)
+) without rowid;'''
+
+headerDef = '''
+create table if not exists
+Header(
+    Key  integer primary key,
+    Path text not null unique
 );'''
 
-definitions = [fileDef, machineDef, compilationDef, argumentDef]
+inclusionDef = '''
+/* One row per header included in a compilation, when include tracing is
+   enabled (see collecting/includes.py).  Sizes are bytes of preprocessed
+   output. */
+create table if not exists
+Inclusion(
+    CompilationKey     integer references Compilation(Key) not null,
+    HeaderKey          integer references Header(Key) not null,
+    IncludedByKey      integer references Header(Key), /* null if by source */
+    Depth              integer not null, /* 1 if included by the source */
+    IncludeCount       integer not null,
+    SelfSizeBytes      integer not null,
+    InclusiveSizeBytes integer not null, /* including nested headers */
 
+    primary key(CompilationKey, HeaderKey)
+) without rowid;'''
 
-def createAll(db):
+timeTracePhaseDef = '''
+/* Time spent in each kind of activity, according to the trace written by
+   clang's -ftime-trace (see collecting/timetrace.py). */
+create table if not exists
+TimeTracePhase(
+    CompilationKey integer references Compilation(Key) not null,
+    Phase          text not null, /* e.g. "Frontend", "InstantiateFunction" */
+    Seconds        real not null,
+    Count          integer not null,
+
+    primary key(CompilationKey, Phase)
+) without rowid;'''
+
+timeTraceDetailDef = '''
+/* The subjects of each kind of activity on which the most time was spent,
+   e.g. the costliest template instantiations, or included files. */
+create table if not exists
+TimeTraceDetail(
+    CompilationKey integer references Compilation(Key) not null,
+    Phase          text not null,
+    Detail         text not null,
+    Seconds        real not null,
+    Count          integer not null,
+
+    primary key(CompilationKey, Phase, Detail)
+) without rowid;'''
+
+compilerPassDef = '''
+/* Time and memory spent in each pass of the compiler, according to GCC's
+   -ftime-report (see collecting/timereport.py).  A column that the report
+   left out is null. */
+create table if not exists
+CompilerPass(
+    CompilationKey integer references Compilation(Key) not null,
+    Pass           text not null,
+    UserTime       real,
+    SysTime        real,
+    WallTime       real,
+    GgcBytes       integer, /* garbage collected memory allocated */
+
+    primary key(CompilationKey, Pass)
+) without rowid;'''
+
+resourceSeriesDef = '''
+/* Memory and CPU time used by the compiler's process tree, sampled over the
+   course of the compilation (see collecting/sampler.py).  The samples are
+   encoded by 'encodeSeries' and decoded by 'decodeSeries'. */
+create table if not exists
+ResourceSeries(
+    CompilationKey integer primary key references Compilation(Key) not null,
+    SampleCount    integer not null,
+    Encoded        blob not null
+);'''
+
+subProcessDef = '''
+/* CPU time and peak memory of each program run by the compiler driver
+   (e.g. "cc1plus", "as", "ld"), as polled from /proc while the compilation
+   ran (see collecting/subprocesses.py). */
+create table if not exists
+SubProcess(
+    CompilationKey   integer references Compilation(Key) not null,
+    Executable       text not null,
+    ProcessCount     integer not null,
+    UserTime         real not null,
+    SysTime          real not null,
+    MaxResidentBytes integer not null, /* largest among the processes */
+
+    primary key(CompilationKey, Executable)
+) without rowid;'''
+
+wrapperOverheadDef = '''
+/* Time spent by the compiler wrapper itself, in each phase of its work (see
+   collecting/overhead.py). */
+create table if not exists
+WrapperOverhead(
+    CompilationKey integer references Compilation(Key) not null,
+    Phase          text not null, /* e.g. "startup", "preprocess", "git" */
+    Seconds        real not null,
+
+    primary key(CompilationKey, Phase)
+) without rowid;'''
+
+maintenanceDef = '''
+/* When each periodic maintenance task (see 'analyzeIfDue') was last done. */
+create table if not exists
+Maintenance(
+    Task        text primary key, /* e.g. "analyze" */
+    LastIso8601 text not null
+);'''
+
+definitions = [
+    diffDef, fileDef, machineDef, buildDef, commandLineDef,
+    commandArgumentDef, compilationDef, argumentViewDef, headerDef,
+    inclusionDef, timeTracePhaseDef, timeTraceDetailDef, compilerPassDef,
+    resourceSeriesDef, subProcessDef, wrapperOverheadDef, maintenanceDef
+]
+
+# Indexes for the queries that reports make: restricting compilations to a
+# period (see 'read.py') and joining them with their files, machines, and
+# builds.  The child tables of Compilation are already indexed by their
+# primary keys, which begin with CompilationKey.
+indexDefs = [
+    'create index if not exists CompilationByStart '
+    'on Compilation(StartIso8601);',
+    'create index if not exists CompilationByFile on Compilation(FileKey);',
+    'create index if not exists CompilationByMachine '
+    'on Compilation(MachineKey);',
+    'create index if not exists CompilationByBuild on Compilation(BuildKey);',
+    'create index if not exists MachineBySystem on Machine(System);'
+]
+
+# Indexes for finding the compilations that used a given argument, e.g.
+#
+#     select count(*) from Compilation c
+#     inner join CommandArgument a on a.CommandLineKey = c.CommandLineKey
+#     where a.Value = '-O2';
+commandLineIndexDefs = [
+    'create index if not exists CommandArgumentByValue '
+    'on CommandArgument(Value);',
+    'create index if not exists CompilationByCommandLine '
+    'on Compilation(CommandLineKey);'
+]
+
+# Columns added to tables after the tables were first defined.  A database
+# created before then gets them when it's next opened (see 'createAll').
+# {table: [(column, type)]}
+addedColumns = {
+    'Compilation': [('MinorPageFaults', 'integer'),
+                    ('MajorPageFaults', 'integer'), ('Swaps', 'integer'),
+                    ('VoluntaryContextSwitches', 'integer'),
+                    ('InvoluntaryContextSwitches', 'integer'),
+                    ('SampleWeight', 'integer'),
+                    ('BuildKey', 'integer references Build(Key)'),
+                    ('CommandLineKey', 'integer references CommandLine(Key)'),
+                    ('SourceArgument', 'text'), ('OutputArgument', 'text')],
+    'File': [('IdentityHash', 'text')],
+    'Machine': [('IdentityHash', 'text')]
+}
+
+# The columns that identify a row of File or Machine: those of the table's
+# unique constraint.  Rows are looked up by the hash of these columns'
+# values (see 'identityHash'), which has an index of its own, rather than by
+# comparing each column.  {table: [column]}
+identityColumns = {
+    'File': ['Name', 'Path', 'GitRevision', 'GitDiffHash', 'SizeBytes'],
+    'Machine': [
+        'Name', 'System', 'Release', 'Version', 'MachineArch', 'Processor',
+        'PageSize'
+    ]
+}
+
+identityIndexDefs = [
+    'create unique index if not exists FileByIdentity '
+    'on File(IdentityHash);',
+    'create unique index if not exists MachineByIdentity '
+    'on Machine(IdentityHash);'
+]
+
+
+def _addMissingColumns(db):
+    for table, columns in addedColumns.items():
+        existing = set(row[1] for row in db.execute(
+            'pragma table_info({});'.format(table)))
+        for column, columnType in columns:
+            if column not in existing:
+                db.execute('alter table {} add column {} {};'.format(
+                    table, column, columnType))
+
+
+def diffHash(text):
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+# Return the IdentityHash of the row having the specified 'values' of its
+# table's 'identityColumns', in order.
+#
+def identityHash(values):
+    data = repr(tuple(values)).encode('utf8', 'surrogateescape')
+    return hashlib.sha256(data).hexdigest()
+
+
+def compressDiff(text):
+    return zlib.compress(text.encode('utf8'))
+
+
+def decompressDiff(compressed):
+    return zlib.decompress(compressed).decode('utf8')
+
+
+# A series of samples [milliseconds, residentKibibytes, cpuMilliseconds] is
+# stored as the difference of each number from the same number in the
+# previous sample, zigzag encoded (so that small negative differences are
+# small, too) and written as a variable length integer: seven bits per byte,
+# least significant first, with the high bit set in every byte but the last.
+# Most differences fit in one or two bytes.
+#
+def encodeSeries(samples):
+    encoded = bytearray()
+    previous = [0, 0, 0]
+    for sample in samples:
+        for i, value in enumerate(sample):
+            delta = value - previous[i]
+            previous[i] = value
+            zigzag = delta * 2 if delta >= 0 else -delta * 2 - 1
+            while zigzag >= 0x80:
+                encoded.append(zigzag & 0x7f | 0x80)
+                zigzag >>= 7
+            encoded.append(zigzag)
+    return bytes(encoded)
+
+
+def decodeSeries(encoded):
+    samples = []
+    previous = [0, 0, 0]
+    sample = []
+    zigzag = shift = 0
+    for byte in encoded:
+        zigzag |= (byte & 0x7f) << shift
+        shift += 7
+        if byte & 0x80:
+            continue
+        delta = zigzag >> 1 if zigzag & 1 == 0 else -(zigzag >> 1) - 1
+        previous[len(sample)] += delta
+        sample.append(previous[len(sample)])
+        zigzag = shift = 0
+        if len(sample) == 3:
+            samples.append(sample)
+            sample = []
+    return samples
+
+
+# Return (arguments, source, output) for the specified 'command', where
+# 'source' is the path to the file compiled and 'output' is the path to the
+# file written, as they appear in the command (or None if they don't), and
+# 'arguments' is 'command' with each occurrence of 'source' replaced by "$S"
+# and of 'output' by "$O", including within other arguments (e.g. "-MF
+# obj/foo.o.d" becomes "-MF $O.d").  Any other "$" becomes "$D".  A path
+# that itself contains "$" isn't replaced.  That way, each "$" in an encoded
+# argument starts one of the three codes, and no code can appear in a path
+# substituted for another, so replacing "$S", then "$O", then "$D" (see
+# 'argumentViewDef') recovers each argument exactly.  As in 'Command', the
+# source is the last argument, and the output follows the last "-o".
+#
+def normalizeCommand(command):
+    source = command[-1] if len(command) > 1 else None
+    output = None
+    for i in range(len(command) - 1, 0, -1):
+        if command[i].startswith('-o'):
+            if command[i] != '-o':
+                output = command[i][len('-o'):]
+            elif i + 1 < len(command):
+                output = command[i + 1]
+            break
+    output = output or None
+
+    # Longer paths first, e.g. "foo.c.o" before "foo.c".
+    replacements = sorted(
+        [(path, token) for path, token in ((source, '$S'), (output, '$O'))
+         if path and '$' not in path],
+        key=lambda replacement: len(replacement[0]),
+        reverse=True)
+    arguments = [_encode(argument, replacements) for argument in command]
+    return arguments, source, output
+
+
+def _encode(text, replacements):
+    if not replacements:
+        return text.replace('$', '$D')
+    (path, token), rest = replacements[0], replacements[1:]
+    return token.join(_encode(part, rest) for part in text.split(path))
+
+
+# Return the hash identifying the command line having the specified
+# normalized 'arguments' (see 'normalizeCommand').  Arguments can't contain
+# NUL, so it separates them; the count distinguishes [] from [""].
+#
+def commandLineHash(arguments):
+    data = '\0'.join([str(len(arguments))] + list(arguments)).encode(
+        'utf8', 'surrogateescape')
+    return hashlib.sha256(data).hexdigest()
+
+
+def _usedBytes(db):
+    pageSize, = db.execute('pragma page_size;').fetchone()
+    pageCount, = db.execute('pragma page_count;').fetchone()
+    freeCount, = db.execute('pragma freelist_count;').fetchone()
+    return (pageCount - freeCount) * pageSize
+
+
+# Databases created before the Diff table existed have the text of each diff
+# in File.GitDiffHead.  Move the diffs into the Diff table and rebuild File to
+# refer to them by hash.  Return a dict describing the space saved, or None
+# if there was nothing to migrate.
+#
+def _migrateDiffs(db):
+    fileColumns = set(row[1] for row in db.execute('pragma table_info(File);'))
+    if 'GitDiffHead' not in fileColumns:
+        return None
+
+    usedBytesBefore = _usedBytes(db)
+    db.create_function('DiffHash', 1, diffHash, deterministic=True)
+    db.create_function('CompressDiff', 1, compressDiff, deterministic=True)
+
+    db.execute('''
+        insert or ignore into Diff(Hash, SizeBytes, Compressed)
+        select DiffHash(GitDiffHead), length(cast(GitDiffHead as blob)),
+               CompressDiff(GitDiffHead)
+        from (select distinct GitDiffHead from File);''')
+
+    db.execute(fileDef.replace('File(', 'MigratedFile(', 1))
+    db.execute('''
+        insert into MigratedFile(Key, Name, Path, GitRevision, GitDiffHash,
+                                 LineCount, SizeBytes, PreprocessedSizeBytes,
+                                 PreprocessedLineCount)
+        select Key, Name, Path, GitRevision, DiffHash(GitDiffHead),
+               LineCount, SizeBytes, PreprocessedSizeBytes,
+               PreprocessedLineCount
+        from File;''')
+
+    diffBytesBefore, = db.execute(
+        'select coalesce(sum(length(cast(GitDiffHead as blob))), 0) '
+        'from File;').fetchone()
+    diffBytesAfter, = db.execute(
+        'select coalesce(sum(length(Compressed)), 0) from Diff;').fetchone()
+
+    db.execute('drop table File;')
+    db.execute('alter table MigratedFile rename to File;')
+    usedBytesAfter = _usedBytes(db)
+
+    return {
+        'diffBytesBefore': diffBytesBefore,
+        'diffBytesAfter': diffBytesAfter,
+        'usedBytesBefore': usedBytesBefore,
+        'usedBytesAfter': usedBytesAfter
+    }
+
+
+# Bring a database from before schema versions to version 1: create the
+# tables that it's missing, and apply the changes made to the others since.
+# A new database goes through here too, and so gets the tables as they are
+# defined above.
+#
+def _migrateUnversioned(db):
     for table in definitions:
         db.execute(table)
+    _addMissingColumns(db)
+    return _migrateDiffs(db)
+
+
+def _addIndexes(db):
+    db.execute(maintenanceDef)
+    for index in indexDefs:
+        db.execute(index)
+
+
+# The tables that refer to Compilation(Key), as [(table, definition)].
+_compilationChildren = [('Argument', argumentDef), ('Inclusion', inclusionDef),
+                        ('TimeTracePhase', timeTracePhaseDef),
+                        ('TimeTraceDetail', timeTraceDetailDef),
+                        ('CompilerPass', compilerPassDef),
+                        ('ResourceSeries', resourceSeriesDef),
+                        ('SubProcess', subProcessDef),
+                        ('WrapperOverhead', wrapperOverheadDef)]
+
+
+def _columns(db, table):
+    return [
+        row[1] for row in db.execute('pragma table_info({});'.format(table))
+    ]
+
+
+# Compilation.Key used to be a random UUID, as text, which every row of the
+# tables referring to the compilation repeated, and whose randomness spread
+# insertions all over the tables' B-trees.  Now it's an integer (the rowid).
+# Rebuild Compilation, numbering the compilations in order of their start,
+# and keep the old keys in Compilation.Uuid.  Rebuild the tables referring to
+# Compilation to refer to the new keys; in the process they become "without
+# rowid" tables, so that each is stored once, in the order of its primary
+# key, rather than once in rowid order and again in its primary key's index.
+# Writers that predate this migration can't add compilations afterward,
+# since their keys are text.  Return a dict describing the space used before
+# and after.
+#
+def _migrateIntegerKeys(db):
+    keyType, = [row[2] for row in db.execute('pragma table_info(Compilation);')
+                if row[1] == 'Key']
+    if keyType.lower() != 'text':
+        return None
+
+    usedBytesBefore = _usedBytes(db)
+
+    # The new tables refer to MigratedCompilation, so that the old tables can
+    # be dropped without violating foreign keys.  Renaming MigratedCompilation
+    # afterward renames the references to it.  The table that Compilation
+    # refers to as of later versions must exist for the rows to be inserted.
+    db.execute(commandLineDef)
+    db.execute(compilationDef.replace('Compilation(', 'MigratedCompilation(',
+                                      1))
+    old = set(_columns(db, 'Compilation'))
+    columns = [column for column in _columns(db, 'MigratedCompilation')
+               if column in old and column != 'Key']
+    db.execute('''
+        insert into MigratedCompilation(Uuid, {columns})
+        select Key, {columns} from Compilation
+        order by StartIso8601;'''.format(columns=', '.join(columns)))
+
+    for table, definition in _compilationChildren:
+        migrated = 'Migrated' + table
+        db.execute(
+            definition.replace(table + '(', migrated + '(', 1).replace(
+                'references Compilation(Key)',
+                'references MigratedCompilation(Key)'))
+        old = set(_columns(db, table))
+        columns = [column for column in _columns(db, migrated)
+                   if column in old and column != 'CompilationKey']
+        db.execute('''
+            insert into {migrated}(CompilationKey, {columns})
+            select c.Key, {prefixed} from {table} t
+            inner join MigratedCompilation c on c.Uuid = t.CompilationKey;'''
+                   .format(migrated=migrated,
+                           table=table,
+                           columns=', '.join(columns),
+                           prefixed=', '.join('t.' + column
+                                              for column in columns)))
+        db.execute('drop table {};'.format(table))
+
+    db.execute('drop table Compilation;')
+    db.execute('alter table MigratedCompilation rename to Compilation;')
+    for table, _ in _compilationChildren:
+        db.execute('alter table Migrated{0} rename to {0};'.format(table))
+    _addIndexes(db)  # The old ones went with the old table.
+
+    return {
+        'keyUsedBytesBefore': usedBytesBefore,
+        'keyUsedBytesAfter': _usedBytes(db)
+    }
+
+
+# Intern the command lines of the compilations in the Argument table (see
+# 'commandLineDef'), and replace the table with a view of the same name.
+# Return a dict describing the space used before and after.
+#
+def _internCommandLines(db):
+    db.execute(commandLineDef)
+    db.execute(commandArgumentDef)
+    _addMissingColumns(db)
+    for index in commandLineIndexDefs:
+        db.execute(index)
+
+    isTable = db.execute("select count(*) from sqlite_master "
+                         "where type = 'table' and name = 'Argument';")
+    if isTable.fetchone() == (0, ):
+        db.execute(argumentViewDef)
+        return None
+
+    import itertools
+
+    usedBytesBefore = _usedBytes(db)
+    commandLineKeys = {}  # {hash: CommandLine.Key}
+    rows = db.cursor().execute('select CompilationKey, Value from Argument '
+                               'order by CompilationKey, Position;')
+    for compilationKey, group in itertools.groupby(rows, lambda row: row[0]):
+        arguments, source, output = normalizeCommand(
+            [value for _, value in group])
+        hash = commandLineHash(arguments)
+        commandLineKey = commandLineKeys.get(hash)
+        if commandLineKey is None:
+            commandLineKey = db.execute(
+                'insert into CommandLine(Hash, ArgumentCount) values(?, ?);',
+                (hash, len(arguments))).lastrowid
+            db.executemany(
+                'insert into CommandArgument(CommandLineKey, Position, Value) '
+                'values(?, ?, ?);',
+                ((commandLineKey, i, value)
+                 for i, value in enumerate(arguments)))
+            commandLineKeys[hash] = commandLineKey
+        db.execute(
+            'update Compilation set CommandLineKey = ?, SourceArgument = ?, '
+            'OutputArgument = ? where Key = ?;',
+            (commandLineKey, source, output, compilationKey))
+
+    db.execute('drop table Argument;')
+    db.execute(argumentViewDef)
+
+    return {
+        'commandLineCount': len(commandLineKeys),
+        'commandLineUsedBytesBefore': usedBytesBefore,
+        'commandLineUsedBytesAfter': _usedBytes(db)
+    }
+
+
+# Set the IdentityHash of each row of File and Machine, and index it.
+#
+def _addIdentityHashes(db):
+    _addMissingColumns(db)
+    for table, columns in identityColumns.items():
+        rows = db.execute('select Key, {} from {};'.format(
+            ', '.join(columns), table)).fetchall()
+        db.executemany(
+            'update {} set IdentityHash = ? where Key = ?;'.format(table),
+            ((identityHash(row[1:]), row[0]) for row in rows))
+    for index in identityIndexDefs:
+        db.execute(index)
+
+
+# Migration i brings a database from version i to version i + 1.  Each may
+# return a dict describing what it did.  Since a new database starts out
+# with the tables as they are defined above, later migrations must allow for
+# the change that they make having been made already.
+_migrations = [
+    _migrateUnversioned, _addIndexes, _migrateIntegerKeys,
+    _internCommandLines, _addIdentityHashes
+]
+
+schemaVersion = len(_migrations)
+
+
+# Bring 'db' up to date with this version of the schema, which is stored in
+# the database's "user_version" (0 for a new database, and for one created
+# before the schema had versions).  When the database is current, this costs
+# one pragma.  Otherwise, the migrations are applied in one transaction.
+# Return a dict describing the migrations performed, or None if there were
+# none.
+#
+# The migrations rebuild tables that others refer to (drop, then rename a
+# copy into place), so foreign keys aren't enforced while they run; instead
+# every reference is checked before committing.  "pragma foreign_keys" has
+# no effect within a transaction, so it's set around the transaction.
+#
+def createAll(db):
+    version, = db.execute('pragma user_version;').fetchone()
+    if version >= schemaVersion:
+        # A newer database is left alone.  That doesn't mean that this
+        # version can write to it: migrations aren't backward compatible.
+        # E.g. the versions of this package before schema version 3 fail to
+        # add compilations to a database migrated to version 3 or later
+        # (see '_migrateIntegerKeys'), so every writer of a database must be
+        # upgraded before the database is migrated (see README.md).
+        return None
+
+    foreignKeys, = db.execute('pragma foreign_keys;').fetchone()
+    db.execute('pragma foreign_keys = off;')
+    try:
+        # Take the write lock before checking again, in case another
+        # process migrated the database in the meantime.
+        db.execute('begin immediate;')
+        version, = db.execute('pragma user_version;').fetchone()
+        if version >= schemaVersion:
+            db.rollback()
+            return None
+
+        description = {'fromVersion': version, 'toVersion': schemaVersion}
+        for migration in _migrations[version:]:
+            description.update(migration(db) or {})
+        violations = db.execute('pragma foreign_key_check;').fetchall()
+        enforce(not violations,
+                'Migration broke foreign keys: {}'.format(violations[:10]))
+        db.execute('pragma user_version = {};'.format(schemaVersion))
+        db.commit()
+        return description
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    finally:
+        db.execute('pragma foreign_keys = {};'.format(foreignKeys))
+
+
+analyzeIntervalHours = 24
+
+
+# Gather statistics about the tables and indexes of 'db' for the query
+# planner ("analyze"), unless that was done within the last
+# 'analyzeIntervalHours'.  This is for readers and batch writers, e.g. report
+# generation; the compiler wrapper never waits for it.  "analysis_limit"
+# bounds how many rows of each index are examined, so that this is quick
+# even for a large database.  Return whether the analysis was done.
+#
+def analyzeIfDue(db):
+    import datetime
+
+    now = datetime.datetime.utcnow()
+    due = (now - datetime.timedelta(hours=analyzeIntervalHours)).isoformat()
+    row = db.execute("select LastIso8601 from Maintenance "
+                     "where Task = 'analyze';").fetchone()
+    if row is not None and row[0] > due:
+        return False
+
+    db.execute('pragma analysis_limit = 1000;')
+    db.execute('analyze;')
+    db.execute(
+        "insert or replace into Maintenance(Task, LastIso8601) "
+        "values('analyze', ?);", (now.isoformat(), ))
     db.commit()
+    return True
 
 
 if __name__ == '__main__':
+    import json
     import sys
     if len(sys.argv) < 2:
         sys.exit()  # No output file
 
     import sqlite3
     db = sqlite3.connect(sys.argv[1])
-    createAll(db)
-    db.commit()
+    migration = createAll(db)
+    if migration:
+        print(json.dumps(migration, indent=4))
 '''
 Copyright (c) 2016 David Goffredo
 
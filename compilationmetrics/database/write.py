@@ -1,90 +1,280 @@
 from ..enforce import enforce
+from .open import writeTransaction
+from .tables import diffHash, compressDiff, encodeSeries, normalizeCommand, \
+    commandLineHash, identityColumns, identityHash
 
-import sys
-import uuid
-import sqlite3
 import datetime
 
 
 #
 # The arguments sourceFileInfo, machineInfo, and resourceInfo are dicts:
 #
-# sourceFileInfo keys: ['name', 'path', 'gitRevision', 'gitDiffHead', 'lineCount', 'sizeBytes']
+# sourceFileInfo keys: ['name', 'path', 'gitRevision', 'gitDiffHead',
+#                       'lineCount', 'sizeBytes', 'preprocessedSizeBytes',
+#                       'preprocessedLineCount']
 #
 # machineInfo keys: ['name', 'system', 'release', 'version', 'machineArch',
 #                    'processor, 'pageSize']
 #
 # resourceInfo keys: ['maxResidentMemoryBytes', 'userCpuTime',
 #                     'systemCpuTime', 'blockingInputOperations',
-#                     'blockingOutputOperations']
+#                     'blockingOutputOperations', 'minorPageFaults',
+#                     'majorPageFaults', 'swaps', 'voluntaryContextSwitches',
+#                     'involuntaryContextSwitches']
+#
+# The optional argument includes is a list of the headers included by the
+# compilation, as described in 'collecting/includes.py', or None.
+#
+# The optional argument timeTrace is a summary of clang's time trace, as
+# described in 'collecting/timetrace.py', or None.
+#
+# The optional argument compilerPasses is a list of the passes reported by
+# GCC's -ftime-report, as described in 'collecting/timereport.py', or None.
+#
+# The optional argument resourceSeries is a list of samples of the memory and
+# CPU time used during the compilation, as described in
+# 'collecting/sampler.py', or None.
+#
+# The optional argument subprocesses is a list of the resources used by each
+# program run during the compilation, as described in
+# 'collecting/subprocesses.py', or None.
+#
+# The optional argument sampleWeight is the number of compilations that this
+# one stands for, as described in 'collecting/policy.py'.
+#
+# The optional argument wrapperOverhead is a list of the times spent by the
+# compiler wrapper itself, as described in 'collecting/overhead.py', or None.
+#
+# The optional argument build describes the build that the compilation was
+# part of, as described in 'collecting/build.py', or None.
+#
+# The entry is added in its own transaction (see 'open.writeTransaction').
 #
 def createEntry(db, user, startDatetime, durationSeconds,
                 outputObjectSizeBytes, sourceFileInfo, machineInfo,
-                resourceInfo, compilerPath, command):
+                resourceInfo, compilerPath, command, includes=None,
+                timeTrace=None, compilerPasses=None, resourceSeries=None,
+                subprocesses=None, sampleWeight=1, wrapperOverhead=None,
+                build=None):
+    return writeTransaction(
+        db, lambda db: addEntry(
+            db, user, startDatetime, durationSeconds, outputObjectSizeBytes,
+            sourceFileInfo, machineInfo, resourceInfo, compilerPath, command,
+            includes, timeTrace, compilerPasses, resourceSeries,
+            subprocesses, sampleWeight, wrapperOverhead, build))
+
+
+# Like 'createEntry', but leave committing to the caller.  This way many
+# entries can share one transaction (see 'collecting/daemon.py').  Return the
+# key of the added compilation.  If the optional 'machineKey' is not None,
+# it's the key of the Machine described by 'machineInfo' (see
+# 'collecting/machinekey.py'), and the Machine table isn't consulted.
+#
+def addEntry(db, user, startDatetime, durationSeconds, outputObjectSizeBytes,
+             sourceFileInfo, machineInfo, resourceInfo, compilerPath,
+             command, includes=None, timeTrace=None, compilerPasses=None,
+             resourceSeries=None, subprocesses=None, sampleWeight=1,
+             wrapperOverhead=None, build=None, machineKey=None):
     db.execute("PRAGMA foreign_keys = ON;")
 
-    machineKey = _addMachine(db, **machineInfo)
+    if machineKey is None:
+        machineKey = addMachine(db, machineInfo)
     fileKey = _addSourceFile(db, **sourceFileInfo)
+    otherColumns = {
+        'SampleWeight': sampleWeight,
+        'BuildKey': _addBuild(db, **build) if build else None
+    }
+    otherColumns.update(_commandLineColumns(db, command, {}))
     compilationKey = _addCompilation(db, user, startDatetime, durationSeconds,
                                      outputObjectSizeBytes, fileKey,
-                                     machineKey, compilerPath, **resourceInfo)
-    _addArguments(db, compilationKey, command)
-    db.commit()
-
+                                     machineKey, compilerPath, otherColumns,
+                                     **resourceInfo)
+    if includes:
+        db.executemany(_insertInclusionTemplate.format(verb='insert'),
+                       _inclusionRows(db, compilationKey, includes, {}))
+    if timeTrace:
+        _addTimeTrace(db, 'insert', *_timeTraceRows(compilationKey, timeTrace))
+    if compilerPasses:
+        _addCompilerPasses(db, 'insert', compilationKey, compilerPasses)
+    if resourceSeries:
+        db.execute(_insertResourceSeriesTemplate.format(verb='insert'),
+                   _resourceSeriesRow(compilationKey, resourceSeries))
+    if subprocesses:
+        db.executemany(_insertSubProcessTemplate.format(verb='insert'),
+                       ([compilationKey] + row for row in subprocesses))
+    if wrapperOverhead:
+        addWrapperOverhead(db, 'insert', compilationKey, wrapperOverhead)
+
+    return compilationKey
+
+
+# Add the specified 'entries' without committing.  Each entry is a dict of
+# 'addEntry' arguments together with a 'compilationKey', a unique identifier
+# that becomes the compilation's Uuid.  An entry whose 'compilationKey' is
+# already in the database is skipped, so adding the same entries again is
+# harmless (see 'collecting/spool.py').  Return the number of entries added.
+#
+def addEntries(db, entries):
+    db.execute("PRAGMA foreign_keys = ON;")
 
-def _addArguments(db, compilationKey, command):
+    machineKeys = {}  # {machine info items: Machine.Key}
+    buildKeys = {}  # {build identifier: Build.Key}
+    headerKeys = {}  # {header path: Header.Key}
+    commandLineKeys = {}  # {command line hash: CommandLine.Key}
+    added = 0
+    inclusions = []
+    phases, details = [], []
+    passes = []
+    series = []
+    subprocesses = []
+    overheads = []
+    for entry in entries:
+        machineInfo = entry['machineInfo']
+        machine = tuple(sorted(machineInfo.items()))
+        machineKey = machineKeys.get(machine)
+        if machineKey is None:
+            machineKey = machineKeys[machine] = addMachine(db, machineInfo)
+
+        fileKey = _addSourceFile(db, **entry['sourceFileInfo'])
+        columns = _compilationColumns(entry['user'], entry['startDatetime'],
+                                      entry['durationSeconds'],
+                                      entry['outputObjectSizeBytes'], fileKey,
+                                      machineKey, entry['compilerPath'],
+                                      **entry['resourceInfo'])
+        columns['SampleWeight'] = entry.get('sampleWeight', 1)
+        columns['BuildKey'] = None
+        build = entry.get('build')
+        if build:
+            buildKey = buildKeys.get(build['identifier'])
+            if buildKey is None:
+                buildKey = buildKeys[build['identifier']] = _addBuild(
+                    db, **build)
+            columns['BuildKey'] = buildKey
+        columns.update(
+            _commandLineColumns(db, entry['command'], commandLineKeys))
+        columns['Uuid'] = entry['compilationKey']
+        cursor = db.execute(
+            "insert or ignore into Compilation({cols}) values({refs});".format(
+                cols=', '.join(columns),
+                refs=', '.join('?' for _ in columns)), list(columns.values()))
+        if cursor.rowcount != 1:
+            continue  # It was added before.
+        added += 1
+        key = cursor.lastrowid
+
+        if entry.get('includes'):
+            inclusions.extend(
+                _inclusionRows(db, key, entry['includes'], headerKeys))
+        if entry.get('timeTrace'):
+            phaseRows, detailRows = _timeTraceRows(key, entry['timeTrace'])
+            phases.extend(phaseRows)
+            details.extend(detailRows)
+        if entry.get('compilerPasses'):
+            passes.extend([key] + row for row in entry['compilerPasses'])
+        if entry.get('resourceSeries'):
+            series.append(_resourceSeriesRow(key, entry['resourceSeries']))
+        if entry.get('subprocesses'):
+            subprocesses.extend([key] + row for row in entry['subprocesses'])
+        if entry.get('wrapperOverhead'):
+            overheads.extend([key] + row for row in entry['wrapperOverhead'])
+
+    db.executemany(_insertInclusionTemplate.format(verb='insert or ignore'),
+                   inclusions)
+    _addTimeTrace(db, 'insert or ignore', phases, details)
+    db.executemany(_insertCompilerPassTemplate.format(verb='insert or ignore'),
+                   passes)
     db.executemany(
-        "insert into Argument(CompilationKey, Position, Value) "
-        "values(?, ?, ?);",
-        ((compilationKey, i, arg) for i, arg in enumerate(command)))
-
+        _insertResourceSeriesTemplate.format(verb='insert or ignore'), series)
+    db.executemany(_insertSubProcessTemplate.format(verb='insert or ignore'),
+                   subprocesses)
+    db.executemany(
+        _insertWrapperOverheadTemplate.format(verb='insert or ignore'),
+        overheads)
 
-def _insert(db, table, columnToValue):
-    template = "insert into {table}({cols}) values({placeholders});"
-    query = template.format(table=table,
-                            cols=', '.join(columnToValue.keys()),
-                            placeholders=', '.join('?' for _ in columnToValue))
-    db.execute(query, columnToValue.values())
+    return added
 
 
-def _didInsert(db, table, columnToValue):
-    try:
-        _insert(db, table, columnToValue)
-        return True
-    except sqlite3.Error as error:
-        print(error, file=sys.stderr)
-        return False
+# Return the key of the CommandLine having the specified normalized
+# 'arguments' (see 'tables.normalizeCommand'), adding it if necessary.  Look
+# in, and add to, the specified 'commandLineKeys' cache, which maps hashes to
+# keys, first.
+#
+def _commandLineKey(db, arguments, commandLineKeys):
+    hash = commandLineHash(arguments)
+    key = commandLineKeys.get(hash)
+    if key is not None:
+        return key
+
+    cursor = db.execute(
+        "insert or ignore into CommandLine(Hash, ArgumentCount) "
+        "values(?, ?);", (hash, len(arguments)))
+    if cursor.rowcount == 1:
+        key = cursor.lastrowid
+        db.executemany(
+            "insert into CommandArgument(CommandLineKey, Position, Value) "
+            "values(?, ?, ?);",
+            ((key, i, arg) for i, arg in enumerate(arguments)))
+    else:
+        key, = db.execute("select Key from CommandLine where Hash = ?;",
+                          (hash, )).fetchone()
+    commandLineKeys[hash] = key
+    return key
+
+
+# Return the Compilation columns that describe the specified 'command'.
+#
+def _commandLineColumns(db, command, commandLineKeys):
+    arguments, source, output = normalizeCommand(command)
+    return {
+        'CommandLineKey': _commandLineKey(db, arguments, commandLineKeys),
+        'SourceArgument': source,
+        'OutputArgument': output
+    }
+
+
+def _compilationColumns(user, startDatetime, durationSeconds,
+                        outputObjectSizeBytes, fileKey, machineKey,
+                        compilerPath, maxResidentMemoryBytes, userCpuTime,
+                        systemCpuTime, blockingInputOperations,
+                        blockingOutputOperations, minorPageFaults=None,
+                        majorPageFaults=None, swaps=None,
+                        voluntaryContextSwitches=None,
+                        involuntaryContextSwitches=None):
+    if isinstance(startDatetime, datetime.datetime):
+        startDatetime = startDatetime.isoformat()
+    return {
+        'User': user,
+        'StartIso8601': startDatetime,
+        'DurationSeconds': durationSeconds,
+        'OutputObjectSizeBytes': outputObjectSizeBytes,
+        'FileKey': fileKey,
+        'MachineKey': machineKey,
+        'CompilerPath': compilerPath,
+        'MaxResidentMemoryBytes': maxResidentMemoryBytes,
+        'UserCpuTime': userCpuTime,
+        'SystemCpuTime': systemCpuTime,
+        'BlockingInputOperations': blockingInputOperations,
+        'BlockingOutputOperations': blockingOutputOperations,
+        'MinorPageFaults': minorPageFaults,
+        'MajorPageFaults': majorPageFaults,
+        'Swaps': swaps,
+        'VoluntaryContextSwitches': voluntaryContextSwitches,
+        'InvoluntaryContextSwitches': involuntaryContextSwitches
+    }
 
 
 def _addCompilation(db, user, startDatetime, durationSeconds,
                     outputObjectSizeBytes, fileKey, machineKey, compilerPath,
-                    maxResidentMemoryBytes, userCpuTime, systemCpuTime,
-                    blockingInputOperations, blockingOutputOperations):
-    if isinstance(startDatetime, datetime.datetime):
-        startDatetime = startDatetime.isoformat()
-    maxAttempts = 5
-    for _ in range(maxAttempts):
-        key = uuid.uuid4().hex
-        if _didInsert(
-                db, 'Compilation', {
-                    'Key': key,
-                    'User': user,
-                    'StartIso8601': startDatetime.isoformat(),
-                    'DurationSeconds': durationSeconds,
-                    'OutputObjectSizeBytes': outputObjectSizeBytes,
-                    'FileKey': fileKey,
-                    'MachineKey': machineKey,
-                    'CompilerPath': compilerPath,
-                    'MaxResidentMemoryBytes': maxResidentMemoryBytes,
-                    'UserCpuTime': userCpuTime,
-                    'SystemCpuTime': systemCpuTime,
-                    'BlockingInputOperations': blockingInputOperations,
-                    'BlockingOutputOperations': blockingOutputOperations
-                }):
-            return key
-
-    msg = 'Unable to insert record after {} attempts.'.format(maxAttempts)
-    raise Exception(msg)
+                    otherColumns, **resourceInfo):
+    columns = _compilationColumns(user, startDatetime, durationSeconds,
+                                  outputObjectSizeBytes, fileKey, machineKey,
+                                  compilerPath, **resourceInfo)
+    columns.update(otherColumns)
+    cursor = db.execute(
+        "insert into Compilation({cols}) values({refs});".format(
+            cols=', '.join(columns), refs=', '.join('?' for _ in columns)),
+        list(columns.values()))
+    return cursor.lastrowid
 
 
 def _addUniqueRecord(db, table, columns, values, keyColumn='Key'):
@@ -107,137 +297,207 @@ def _addUniqueRecord(db, table, columns, values, keyColumn='Key'):
     return results[0][0]
 
 
-def _addSourceFile(db, name, path, gitRevision, gitDiffHead, lineCount,
-                   sizeBytes, preprocessedSizeBytes, preprocessedLineCount):
-    columns = [
-        'Name', 'Path', 'GitRevision', 'GitDiffHead', 'LineCount', 'SizeBytes',
-        'PreprocessedSizeBytes', 'PreprocessedLineCount'
-    ]
-    values = (name, path, gitRevision, gitDiffHead, lineCount, sizeBytes,
-              preprocessedSizeBytes, preprocessedLineCount)
+# Return the key of the row of the specified 'table' (File or Machine) having
+# the specified 'values' of the specified 'columns', adding the row if
+# necessary.  The row is found by its IdentityHash (see
+# 'tables.identityHash'), so the columns that aren't part of the identity
+# (e.g. a File's LineCount) are taken from whichever compilation added the
+# row, except that any of them that are NULL there are filled in from
+# 'values'.
+#
+def _addIdentifiedRecord(db, table, columns, values):
+    byColumn = dict(zip(columns, values))
+    identity = [byColumn[column] for column in identityColumns[table]]
+    hash = identityHash(identity)
+    row = db.execute(
+        "select Key from {} where IdentityHash = ?;".format(table),
+        (hash, )).fetchone()
+    if row is not None:
+        _fillMissing(db, table, row[0], byColumn)
+        return row[0]
+
+    cursor = db.execute(
+        "insert or ignore into {table}(IdentityHash, {cols}) "
+        "values(?, {refs});".format(table=table,
+                                    cols=', '.join(columns),
+                                    refs=', '.join('?' for _ in columns)),
+        (hash, ) + tuple(values))
+    if cursor.rowcount == 1:
+        return cursor.lastrowid
+
+    # The row was added by a version of this package that didn't set its
+    # IdentityHash.
+    key = _addUniqueRecord(db, table, identityColumns[table], identity)
+    db.execute("update {} set IdentityHash = ? where Key = ?;".format(table),
+               (hash, key))
+    _fillMissing(db, table, key, byColumn)
+    return key
+
+
+# Set those columns of the row of the specified 'table' having the specified
+# 'key' that are NULL, and aren't part of the table's identity, to their
+# values in the specified 'byColumn', where those aren't None.  The row isn't
+# written to unless something changes.
+#
+def _fillMissing(db, table, key, byColumn):
+    known = {
+        column: value
+        for column, value in byColumn.items()
+        if value is not None and column not in identityColumns[table]
+    }
+    if not known:
+        return
+
+    db.execute(
+        "update {table} set {sets} where Key = ? and ({nulls});".format(
+            table=table,
+            sets=', '.join('{0} = coalesce({0}, ?)'.format(column)
+                           for column in known),
+            nulls=' or '.join(column + ' is null' for column in known)),
+        list(known.values()) + [key])
+
+
+# Return the hash of the specified 'diff', having added it to the Diff table
+# if it wasn't there already.
+#
+def _addDiff(db, diff):
+    hash = diffHash(diff)
+    db.execute(
+        "insert or ignore into Diff(Hash, SizeBytes, Compressed) "
+        "values(?, ?, ?);", (hash, len(diff.encode('utf8')), compressDiff(diff)))
+    return hash
 
-    return _addUniqueRecord(db, 'File', columns, values)
 
+def _headerKey(db, path, headerKeys):
+    key = headerKeys.get(path)
+    if key is None:
+        key = headerKeys[path] = _addUniqueRecord(db, 'Header', ['Path'],
+                                                  (path, ))
+    return key
 
-def _addMachine(db, name, system, release, version, machineArch, processor,
-                pageSize):
-    columns = [
-        'Name', 'System', 'Release', 'Version', 'MachineArch', 'Processor',
-        'PageSize'
-    ]
-    values = (name, system, release, version, machineArch, processor, pageSize)
 
-    return _addUniqueRecord(db, 'Machine', columns, values)
+_insertInclusionTemplate = (
+    "{verb} into Inclusion(CompilationKey, HeaderKey, IncludedByKey, Depth, "
+    "IncludeCount, SelfSizeBytes, InclusiveSizeBytes) "
+    "values(?, ?, ?, ?, ?, ?, ?);")
 
 
+# Return rows for '_insertInclusionTemplate' describing the specified
+# 'includes' of the compilation having the specified 'compilationKey', adding
+# headers to the Header table as needed.  'headerKeys' is a dict of
+# {path: Header.Key} that's used, and updated, to avoid looking up the same
+# header more than once.
 #
-# sourceFileInfo keys: ['name', 'path', 'gitRevision', 'gitDiffHead']
-#
-# machineInfo keys: ['name', 'system', 'release', 'version', 'machineArch',
-#                    'processor, 'pageSize']
-#
-# resourceInfo keys: ['maxResidentMemoryBytes', 'userCpuTime',
-#                     'systemCpuTime', 'blockingInputOperations',
-#                     'blockingOutputOperations']
-#
-def createEntry(db, user, startDatetime, durationSeconds,
-                outputObjectSizeBytes, sourceFileInfo, machineInfo,
-                resourceInfo, compilerPath, command):
-    db.execute("PRAGMA foreign_keys = ON;")
-
-    machineKey = _addMachine(db, **machineInfo)
-    fileKey = _addSourceFile(db, **sourceFileInfo)
-    compilationKey = _addCompilation(db, user, startDatetime, durationSeconds,
-                                     outputObjectSizeBytes, fileKey,
-                                     machineKey, compilerPath, **resourceInfo)
-    _addArguments(db, compilationKey, command)
-    db.commit()
-
-
-def _addArguments(db, compilationKey, command):
+def _inclusionRows(db, compilationKey, includes, headerKeys):
+    rows = []
+    for (path, includedBy, depth, includeCount, selfBytes,
+         inclusiveBytes) in includes:
+        includedByKey = None
+        if includedBy is not None:
+            includedByKey = _headerKey(db, includedBy, headerKeys)
+        rows.append((compilationKey, _headerKey(db, path, headerKeys),
+                     includedByKey, depth, includeCount, selfBytes,
+                     inclusiveBytes))
+    return rows
+
+
+def _timeTraceRows(compilationKey, timeTrace):
+    phases = [(compilationKey, phase, seconds, count)
+              for phase, seconds, count in timeTrace['phases']]
+    details = [(compilationKey, phase, detail, seconds, count)
+               for phase, detail, seconds, count in timeTrace['details']]
+    return phases, details
+
+
+def _addTimeTrace(db, verb, phases, details):
+    db.executemany(
+        verb + " into TimeTracePhase(CompilationKey, Phase, Seconds, Count) "
+        "values(?, ?, ?, ?);", phases)
     db.executemany(
-        "insert into Argument(CompilationKey, Position, Value) "
-        "values(?, ?, ?);",
-        ((compilationKey, i, arg) for i, arg in enumerate(command)))
+        verb + " into TimeTraceDetail(CompilationKey, Phase, Detail, Seconds, "
+        "Count) values(?, ?, ?, ?, ?);", details)
 
 
-def _insert(db, table, columnToValue):
-    template = "insert into {table}({cols}) values({placeholders});"
-    query = template.format(table=table,
-                            cols=', '.join(columnToValue.keys()),
-                            placeholders=', '.join('?' for _ in columnToValue))
-    db.execute(query, list(columnToValue.values()))
+_insertCompilerPassTemplate = (
+    "{verb} into CompilerPass(CompilationKey, Pass, UserTime, SysTime, "
+    "WallTime, GgcBytes) values(?, ?, ?, ?, ?, ?);")
 
 
-def _didInsert(db, table, columnToValue):
-    try:
-        _insert(db, table, columnToValue)
-        return True
-    except sqlite3.Error as error:
-        print(error, file=sys.stderr)
-        return False
+def _addCompilerPasses(db, verb, compilationKey, compilerPasses):
+    db.executemany(_insertCompilerPassTemplate.format(verb=verb),
+                   ([compilationKey] + row for row in compilerPasses))
 
 
-def _addCompilation(db, user, startDatetime, durationSeconds,
-                    outputObjectSizeBytes, fileKey, machineKey, compilerPath,
-                    maxResidentMemoryBytes, userCpuTime, systemCpuTime,
-                    blockingInputOperations, blockingOutputOperations):
-    if isinstance(startDatetime, datetime.datetime):
-        startDatetime = startDatetime.isoformat()
-    maxAttempts = 5
-    for _ in range(maxAttempts):
-        key = uuid.uuid4().hex
-        if _didInsert(
-                db, 'Compilation', {
-                    'Key': key,
-                    'User': user,
-                    'StartIso8601': startDatetime,
-                    'DurationSeconds': durationSeconds,
-                    'OutputObjectSizeBytes': outputObjectSizeBytes,
-                    'FileKey': fileKey,
-                    'MachineKey': machineKey,
-                    'CompilerPath': compilerPath,
-                    'MaxResidentMemoryBytes': maxResidentMemoryBytes,
-                    'UserCpuTime': userCpuTime,
-                    'SystemCpuTime': systemCpuTime,
-                    'BlockingInputOperations': blockingInputOperations,
-                    'BlockingOutputOperations': blockingOutputOperations
-                }):
-            return key
-
-    msg = 'Unable to insert record after {} attempts.'.format(maxAttempts)
-    raise Exception(msg)
+_insertResourceSeriesTemplate = (
+    "{verb} into ResourceSeries(CompilationKey, SampleCount, Encoded) "
+    "values(?, ?, ?);")
 
 
-def _addUniqueRecord(db, table, columns, values, keyColumn='Key'):
-    colsStr = ', '.join(columns)
-    refs = ', '.join('?' for _ in columns)
-    template = "insert or ignore into {table}({cols}) values({refs});"
+def _resourceSeriesRow(compilationKey, resourceSeries):
+    return (compilationKey, len(resourceSeries), encodeSeries(resourceSeries))
 
-    db.execute(template.format(table=table, cols=colsStr, refs=refs), values)
 
-    pred = ' and '.join(col + ' is ?' for col in columns)
-    template = "select {keyCol} from {table} where {pred};"
+_insertSubProcessTemplate = (
+    "{verb} into SubProcess(CompilationKey, Executable, ProcessCount, "
+    "UserTime, SysTime, MaxResidentBytes) values(?, ?, ?, ?, ?, ?);")
 
-    c = db.execute(template.format(keyCol=keyColumn, table=table, pred=pred),
-                   values)
 
-    results = list(c)
-    enforce(len(results) == 1, "Bad insert or uniqueness constraint?")
-    enforce(len(results[0]) == 1, "Wrong number of columns returned.")
+_insertWrapperOverheadTemplate = (
+    "{verb} into WrapperOverhead(CompilationKey, Phase, Seconds) "
+    "values(?, ?, ?);")
 
-    return results[0][0]
+
+# Add the specified 'wrapperOverhead' (see 'createEntry') to the compilation
+# having the specified 'compilationKey', using the specified SQL 'verb' (e.g.
+# "insert").
+#
+def addWrapperOverhead(db, verb, compilationKey, wrapperOverhead):
+    db.executemany(_insertWrapperOverheadTemplate.format(verb=verb),
+                   ([compilationKey] + row for row in wrapperOverhead))
 
 
-def _addMachine(db, name, system, release, version, machineArch, processor,
-                pageSize):
+def _addSourceFile(db, name, path, gitRevision, gitDiffHead, lineCount,
+                   sizeBytes, preprocessedSizeBytes, preprocessedLineCount):
     columns = [
-        'Name', 'System', 'Release', 'Version', 'MachineArch', 'Processor',
-        'PageSize'
+        'Name', 'Path', 'GitRevision', 'GitDiffHash', 'LineCount', 'SizeBytes',
+        'PreprocessedSizeBytes', 'PreprocessedLineCount'
     ]
-    values = (name, system, release, version, machineArch, processor, pageSize)
+    values = (name, path, gitRevision, _addDiff(db, gitDiffHead), lineCount,
+              sizeBytes, preprocessedSizeBytes, preprocessedLineCount)
 
-    return _addUniqueRecord(db, 'Machine', columns, values)
+    return _addIdentifiedRecord(db, 'File', columns, values)
+
+
+def _addBuild(db, identifier, tool, startDatetime, cores):
+    # The first compilation recorded for a build describes it.
+    db.execute(
+        "insert or ignore into Build(Identifier, Tool, StartIso8601, Cores) "
+        "values(?, ?, ?, ?);", (identifier, tool, startDatetime, cores))
+    key, = db.execute("select Key from Build where Identifier = ?;",
+                      (identifier, )).fetchone()
+    return key
+
+
+def _machineValues(machineInfo):
+    return (machineInfo['name'], machineInfo['system'],
+            machineInfo['release'], machineInfo['version'],
+            machineInfo['machineArch'], machineInfo['processor'],
+            machineInfo['pageSize'])
+
+
+# Return the IdentityHash of the Machine described by the specified
+# 'machineInfo'.
+#
+def machineIdentityHash(machineInfo):
+    return identityHash(_machineValues(machineInfo))
+
+
+# Return the key of the Machine described by the specified 'machineInfo',
+# adding it if necessary.
+#
+def addMachine(db, machineInfo):
+    return _addIdentifiedRecord(db, 'Machine', identityColumns['Machine'],
+                                _machineValues(machineInfo))
 
 
 '''
@@ -83,7 +83,7 @@ def definePlot(definition, queries):
     def setStyle(trait):
         enforce(len(trait.args) == 1, 'A style needs (only) a name.')
         style = trait.args[0]
-        whiteset = {'bars', 'line'}
+        whiteset = {'bars', 'line', 'overlay'}
         enforce(style in whiteset, 'Unknown style "{}"'.format(style))
         plot.style = style
 
@@ -1,4 +1,4 @@
-from distutils.spawn import find_executable
+from shutil import which
 import subprocess
 import os
 import json
@@ -7,7 +7,7 @@ from ..enforce import enforce
 
 
 def hasGnuplot():
-    return find_executable('gnuplot') is not None
+    return which('gnuplot') is not None
 
 
 # Prepare for sending to gnuplot as data. Print as-is, except for strings,
@@ -1,4 +1,4 @@
-from distutils.spawn import find_executable
+from shutil import which
 from contextlib import contextmanager
 import subprocess
 import os.path
@@ -6,7 +6,7 @@ from ..enforce import enforce
 
 
 def hasPerl():
-    return find_executable('perl') is not None
+    return which('perl') is not None
 
 
 @contextmanager
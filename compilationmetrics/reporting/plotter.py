@@ -81,7 +81,28 @@ def _horizontalBars(xAxisLabel, yAxisLabel, yMin, yMax):
                            yMaxOrStar=ifNone(yMax, '*'))
 
 
-_styles = {'horizontal-bars': _horizontalBars}
+# An overlay plots one line per label, where each data row is
+# (label, x, y), and the rows for a label are adjacent and ordered by x.
+# Since the plot command has to name each line before any data is read, the
+# data goes into a gnuplot data block, and the plot command comes after it
+# (see '_OverlayHandle').
+def _overlay(xAxisLabel, yAxisLabel, yMin, yMax):
+    template = '\n'.join([
+        "set key outside right top", "set grid", "set xlabel {xlabel}",
+        "set ylabel {ylabel}", "set yrange [{yMinOrStar}:{yMaxOrStar}]",
+        "$Data << EOD"
+    ]) + '\n'
+
+    def ifNone(value, valueIfNone):
+        return valueIfNone if value is None else value
+
+    return template.format(xlabel=_doubleQuote(ifNone(xAxisLabel, ' ')),
+                           ylabel=_doubleQuote(ifNone(yAxisLabel, ' ')),
+                           yMinOrStar=ifNone(yMin, '*'),
+                           yMaxOrStar=ifNone(yMax, '*'))
+
+
+_styles = {'horizontal-bars': _horizontalBars, 'overlay': _overlay}
 
 _rotatedStyles = frozenset(['horizontal-bars'])
 
@@ -127,8 +148,8 @@ def _setupPlot(plot, imageFolder, gnuplotInstance):
                            plot.yMax))
 
 
-def _finishPlot(plot, imageFolder, gp):
-    gp.endDataSection()
+def _finishPlot(plot, imageFolder, gp, handle):
+    handle.finish()
     gp.closeOutput()
     if plot.style in _rotatedStyles:
         _rotate(plot, imageFolder, gp)
@@ -159,13 +180,45 @@ class RendererHandle(object):
     def addRecord(self, row):
         return self.writeDataRow(row)
 
+    def finish(self):
+        self._gp.endDataSection()
+
+
+# The handle for the "overlay" style.  Rows are (label, x, y).  Each label's
+# rows become a separate block of the data block, and then a separate line in
+# the plot.
+class _OverlayHandle(RendererHandle):
+    def __init__(self, gnuplotInstance):
+        super().__init__(gnuplotInstance)
+        self._labels = []
+
+    def writeDataRow(self, row):
+        label, x, y = row
+        if not self._labels or self._labels[-1] != label:
+            if self._labels:
+                self._gp.writeLine('\n\n')  # two blank lines end a block
+            self._labels.append(label)
+        return self._gp.writeDataRow([x, y])
+
+    def finish(self):
+        self._gp.send('EOD')
+        if self._labels:
+            self._gp.send('plot ' + ', '.join(
+                '$Data index {} using 1:2 with lines title {}'.format(
+                    i, _doubleQuote(label))
+                for i, label in enumerate(self._labels)))
+
+
+_handles = {'overlay': _OverlayHandle}
+
 
 @contextmanager
 def Renderer(plot, imageFolder, gnuplotInstance=None):
     with scopeOrNope(gnuplotInstance) as gp:
         _setupPlot(plot, imageFolder, gp)
-        yield RendererHandle(gp)
-        _finishPlot(plot, imageFolder, gp)
+        handle = _handles.get(plot.style, RendererHandle)(gp)
+        yield handle
+        _finishPlot(plot, imageFolder, gp, handle)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,48 @@
+
+.define-query 'overhead-by-phase'
+
+    select o.Phase, sum(o.Seconds) as TotalSeconds
+    from WrapperOverhead o inner join CompilationView c
+       on o.CompilationKey = c.Key
+    group by o.Phase
+    order by TotalSeconds desc;
+
+.define-plot 'overhead-by-phase.png'
+.query 'overhead-by-phase'
+
+.define-plot 'overhead-by-machine.png'
+
+    select c.MachineName, sum(o.Seconds) as TotalSeconds
+    from WrapperOverhead o inner join CompilationView c
+       on o.CompilationKey = c.Key
+    group by c.MachineName
+    order by TotalSeconds desc
+    limit 25;
+
+.define-plot 'overhead-by-build.png'
+
+    /* Compilations that weren't part of a known build (see
+       collecting/build.py) are grouped by user, machine, and day. */
+    select coalesce(b.Identifier,
+                    c.User || '@' || c.MachineName || ' '
+                        || substr(c.StartIso8601, 1, 10)) as Build,
+           sum(o.Seconds) as TotalSeconds
+    from WrapperOverhead o inner join CompilationView c
+       on o.CompilationKey = c.Key
+    left join Build b on c.BuildKey = b.Key
+    group by Build
+    order by TotalSeconds desc
+    limit 25;
+
+.define-plot 'overhead-share.png'
+
+    /* Wrapper overhead as a percentage of compiler time, per machine */
+    select c.MachineName,
+           100 * sum(o.Seconds) / sum(c.DurationSeconds) as OverheadPercent
+    from CompilationView c inner join
+         (select CompilationKey, sum(Seconds) as Seconds
+          from WrapperOverhead
+          group by CompilationKey) o on o.CompilationKey = c.Key
+    group by c.MachineName
+    order by OverheadPercent desc
+    limit 25;
@@ -57,3 +57,104 @@
 .query 'memory'
 .system 'Linux'
 .period '2016-02-03' '2016-02-04'
+
+.define-plot 'header-cost.png'
+.width 1024
+.height 768
+
+    select HeaderPath, sum(InclusiveSeconds) as TotalSeconds
+    from HeaderCostView
+    group by HeaderPath
+    order by TotalSeconds desc
+    limit 25;
+
+.define-plot 'header-size.png'
+
+    select HeaderPath, avg(SelfSizeBytes) as AvgSelfBytes
+    from HeaderCostView
+    group by HeaderPath
+    order by AvgSelfBytes desc
+    limit 25;
+
+.define-plot 'frontend-vs-backend.png'
+
+    select FileName,
+           avg(FrontendSeconds) as AvgFrontend,
+           avg(BackendSeconds) as AvgBackend
+    from CompilationView
+    where FrontendSeconds is not null
+    group by FileName
+    order by avg(DurationSeconds) desc
+    limit 25;
+
+.define-plot 'costliest-instantiations.png'
+
+    select d.Detail, sum(d.Seconds) as TotalSeconds
+    from TimeTraceDetail d inner join CompilationView c
+       on d.CompilationKey = c.Key
+    where d.Phase in ('InstantiateFunction', 'InstantiateClass')
+    group by d.Detail
+    order by TotalSeconds desc
+    limit 25;
+
+.define-plot 'compiler-passes.png'
+
+    select p.Pass, sum(p.WallTime) as TotalWallTime
+    from CompilerPass p inner join CompilationView c
+       on p.CompilationKey = c.Key
+    where p.Pass not like 'phase %'
+    group by p.Pass
+    order by TotalWallTime desc
+    limit 25;
+
+.define-plot 'memory-over-time.png'
+.style 'overlay'
+.width 1024
+.height 768
+.xAxisLabel 'seconds since the compilation started'
+.yAxisLabel 'resident memory (MiB)'
+
+    select c.FileName || ' #' || c.Key, s.Seconds,
+           s.RssBytes / 1048576.0
+    from ResourceSample s inner join CompilationView c
+       on s.CompilationKey = c.Key
+    where c.Key in (select CompilationKey from ResourceSample
+                    group by CompilationKey
+                    order by max(RssBytes) desc
+                    limit 10)
+    order by c.Key, s.Seconds;
+
+.define-plot 'subprocess-cpu.png'
+
+    select p.Executable, sum(p.UserTime + p.SysTime) as TotalCpuTime
+    from SubProcess p inner join CompilationView c
+       on p.CompilationKey = c.Key
+    group by p.Executable
+    order by TotalCpuTime desc
+    limit 25;
+
+.define-plot 'build-parallelism.png'
+
+    select Build, AverageParallelism
+    from (select coalesce(Tool, 'build') || ' ' || FirstStartIso8601
+                     as Build, AverageParallelism, FirstStartIso8601
+          from Build
+          where CompilationCount is not null
+            and Key in (select BuildKey from CompilationView)
+          order by FirstStartIso8601 desc
+          limit 25);
+
+.define-plot 'build-longest-chain.png'
+
+    /* The longest chain of compilations, as a percentage of each build's
+       wall time */
+    select Build, ChainPercent
+    from (select coalesce(Tool, 'build') || ' ' || FirstStartIso8601
+                     as Build,
+                 100 * LongestChainSeconds / WallSeconds as ChainPercent,
+                 FirstStartIso8601
+          from Build
+          where CompilationCount is not null and WallSeconds > 0
+            and Key in (select BuildKey from CompilationView)
+          order by FirstStartIso8601 desc
+          limit 25);
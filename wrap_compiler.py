@@ -10,7 +10,7 @@ def main():
 
         def handleMetrics(request):
             print(json.dumps(request, indent=4))
-            return collect.writeToDatabase(request)
+            return collect.record(request)
 
         sys.exit(
             collect.collect(sys.argv[1:], callback=handleMetrics, debug=True))